@@ -7,20 +7,79 @@ The actual ESP32 code would be in C++ using the Arduino framework.
 This example shows the expected MQTT message formats.
 """
 
+import argparse
+import asyncio
+import os
+import struct
 import paho.mqtt.client as mqtt
-import json
+import orjson
 import time
 import random
 
 
+# Payload encoding, must match the controller's WIRE_FORMAT setting
+WIRE_FORMAT = os.getenv('WIRE_FORMAT', 'json').lower()
+
+# Binary frames (little-endian fixed point), see README "Binary Sensor Format"
+VALUE_FRAME = struct.Struct('<hB')
+BME280_FRAME = struct.Struct('<hHHB')
+
+
+def simulated_readings():
+    """Return one cycle of simulated sensor readings with some variation."""
+    return {
+        # Simulate pH reading (target around 6.0)
+        'ph': round(6.0 + random.uniform(-0.5, 0.5), 2),
+        # Simulate EC reading (target around 1.5)
+        'ec': round(1.5 + random.uniform(-0.3, 0.3), 2),
+        # Simulate temperature reading
+        'temperature': round(24.0 + random.uniform(-3, 3), 2),
+        # Simulate BME280 reading
+        'bme280': (
+            round(24.0 + random.uniform(-2, 2), 2),
+            round(65.0 + random.uniform(-10, 10), 2),
+            round(1013.25 + random.uniform(-5, 5), 2),
+        ),
+    }
+
+
+class PayloadEncoder:
+    """Encodes sensor payloads as JSON or binary frames."""
+    
+    def __init__(self, sensor_id='esp32_1', node_index=1, wire_format=WIRE_FORMAT):
+        self.sensor_id = sensor_id
+        self.node_index = node_index
+        self.binary = wire_format == 'binary'
+        self._base = {'sensor_id': sensor_id}
+        
+    def encode_value(self, value):
+        """Encode a single-value (pH/EC/temperature) reading."""
+        if self.binary:
+            return VALUE_FRAME.pack(round(value * 100), self.node_index)
+        return orjson.dumps({**self._base, 'value': value})
+        
+    def encode_bme280(self, temperature, humidity, pressure):
+        """Encode a BME280 reading."""
+        if self.binary:
+            return BME280_FRAME.pack(round(temperature * 100), round(humidity * 100),
+                                     round(pressure * 10), self.node_index)
+        return orjson.dumps({
+            **self._base,
+            'temperature': temperature,
+            'humidity': humidity,
+            'pressure': pressure,
+        })
+
+
 class ESP32SensorSimulator:
     """Simulates an ESP32 sensor node for testing purposes."""
     
-    def __init__(self, broker='localhost', port=1883, sensor_id='esp32_1'):
+    def __init__(self, broker='localhost', port=1883, sensor_id='esp32_1', node_index=1):
         self.broker = broker
         self.port = port
         self.sensor_id = sensor_id
-        self.client = mqtt.Client(client_id=f'esp32_simulator_{sensor_id}')
+        self.encoder = PayloadEncoder(sensor_id, node_index)
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f'esp32_simulator_{sensor_id}')
         
     def connect(self):
         """Connect to MQTT broker."""
@@ -35,78 +94,97 @@ class ESP32SensorSimulator:
         
     def publish_ph_reading(self, value):
         """Publish pH sensor reading."""
-        payload = {
-            'value': value,
-            'sensor_id': self.sensor_id
-        }
-        self.client.publish('pfal/sensors/ph', json.dumps(payload))
+        self.client.publish('pfal/sensors/ph', self.encoder.encode_value(value))
         print(f"Published pH: {value}")
         
     def publish_ec_reading(self, value):
         """Publish EC sensor reading."""
-        payload = {
-            'value': value,
-            'sensor_id': self.sensor_id
-        }
-        self.client.publish('pfal/sensors/ec', json.dumps(payload))
+        self.client.publish('pfal/sensors/ec', self.encoder.encode_value(value))
         print(f"Published EC: {value}")
         
     def publish_temperature_reading(self, value):
         """Publish temperature sensor reading."""
-        payload = {
-            'value': value,
-            'sensor_id': self.sensor_id
-        }
-        self.client.publish('pfal/sensors/temperature', json.dumps(payload))
+        self.client.publish('pfal/sensors/temperature', self.encoder.encode_value(value))
         print(f"Published Temperature: {value}°C")
         
     def publish_bme280_reading(self, temperature, humidity, pressure):
         """Publish BME280 sensor reading."""
-        payload = {
-            'temperature': temperature,
-            'humidity': humidity,
-            'pressure': pressure,
-            'sensor_id': self.sensor_id
-        }
-        self.client.publish('pfal/sensors/bme280', json.dumps(payload))
+        payload = self.encoder.encode_bme280(temperature, humidity, pressure)
+        self.client.publish('pfal/sensors/bme280', payload)
         print(f"Published BME280: Temp={temperature}°C, Humidity={humidity}%, Pressure={pressure}hPa")
         
     def simulate_sensors(self):
         """Simulate sensor readings with some variation."""
         while True:
-            # Simulate pH reading (target around 6.0)
-            ph = 6.0 + random.uniform(-0.5, 0.5)
-            self.publish_ph_reading(round(ph, 2))
-            
-            # Simulate EC reading (target around 1.5)
-            ec = 1.5 + random.uniform(-0.3, 0.3)
-            self.publish_ec_reading(round(ec, 2))
-            
-            # Simulate temperature reading
-            temp = 24.0 + random.uniform(-3, 3)
-            self.publish_temperature_reading(round(temp, 2))
-            
-            # Simulate BME280 reading
-            bme_temp = 24.0 + random.uniform(-2, 2)
-            bme_humidity = 65.0 + random.uniform(-10, 10)
-            bme_pressure = 1013.25 + random.uniform(-5, 5)
-            self.publish_bme280_reading(
-                round(bme_temp, 2),
-                round(bme_humidity, 2),
-                round(bme_pressure, 2)
-            )
+            readings = simulated_readings()
+            self.publish_ph_reading(readings['ph'])
+            self.publish_ec_reading(readings['ec'])
+            self.publish_temperature_reading(readings['temperature'])
+            self.publish_bme280_reading(*readings['bme280'])
             
             # Wait 10 seconds before next reading
             time.sleep(10)
 
 
+class AsyncESP32SensorSimulator:
+    """
+    Asyncio variant of the simulator for throughput testing.
+    
+    Uses aiomqtt instead of paho's loop_start() thread and issues the four
+    publishes of each cycle concurrently, so they are pipelined on the
+    connection instead of written one by one.
+    """
+    
+    def __init__(self, broker='localhost', port=1883, sensor_id='esp32_1', node_index=1,
+                 interval=10.0):
+        self.broker = broker
+        self.port = port
+        self.sensor_id = sensor_id
+        self.interval = interval
+        self.encoder = PayloadEncoder(sensor_id, node_index)
+        
+    async def simulate_sensors(self):
+        """Simulate sensor readings until cancelled."""
+        # Only needed for the async simulator (pip install -r requirements-dev.txt)
+        import aiomqtt
+        
+        async with aiomqtt.Client(self.broker, port=self.port,
+                                  identifier=f'esp32_simulator_{self.sensor_id}') as client:
+            print(f"Connected to MQTT broker at {self.broker}:{self.port}")
+            while True:
+                readings = simulated_readings()
+                encoder = self.encoder
+                await asyncio.gather(
+                    client.publish('pfal/sensors/ph', encoder.encode_value(readings['ph'])),
+                    client.publish('pfal/sensors/ec', encoder.encode_value(readings['ec'])),
+                    client.publish('pfal/sensors/temperature',
+                                   encoder.encode_value(readings['temperature'])),
+                    client.publish('pfal/sensors/bme280',
+                                   encoder.encode_bme280(*readings['bme280'])),
+                )
+                print(f"Published cycle: {readings}")
+                await asyncio.sleep(self.interval)
+
+
 if __name__ == '__main__':
     """
     Example usage for testing the PFAL controller.
     
     Run this simulator to generate test sensor data:
-        python examples/esp32_sensor_simulator.py
+        python examples/esp32_sensor_simulator.py [--async]
     """
+    parser = argparse.ArgumentParser(description='ESP32 sensor node simulator')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='Use the asyncio (aiomqtt) simulator')
+    args = parser.parse_args()
+    
+    if args.use_async:
+        try:
+            asyncio.run(AsyncESP32SensorSimulator().simulate_sensors())
+        except KeyboardInterrupt:
+            print("\nStopping simulator...")
+        raise SystemExit(0)
+    
     simulator = ESP32SensorSimulator()
     simulator.connect()
     
@@ -15,21 +15,12 @@ See config/config.example.env for configuration options.
 
 import sys
 import os
-import argparse
 
-# Add src directory to Python path
+# Add src directory to Python path (the package is not installed)
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
 from pfal_controller import main
 
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='PFAL Controller - Rule-based automation')
-    parser.add_argument('--config', type=str, help='Path to configuration file')
-    args = parser.parse_args()
-    
-    # Set config file if provided
-    if args.config:
-        os.environ['CONFIG_FILE'] = args.config
-    
     main()
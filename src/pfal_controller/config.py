@@ -1,11 +1,34 @@
 """Configuration module for PFAL Controller."""
 import os
 import json
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, Optional
 from dotenv import load_dotenv
 
 
+# Directory holding the crop profile JSON files
+PROFILES_DIR = os.path.normpath(
+    os.path.join(os.path.dirname(__file__), '..', '..', 'config', 'profiles')
+)
+
+# Accepted WIRE_FORMAT values (sensor payload encodings)
+WIRE_FORMATS = ('json', 'binary')
+
+# Actuator names; each has a topic_<name> field in MQTTConfig
+ACTUATORS = ('ph_pump', 'nutrient_pump', 'main_pump', 'lights', 'fans')
+
+# Publish QoS per actuator: fire-and-forget for on/off state (the controller
+# re-sends state lost to a failed publish or a reconnect), acknowledged for pump doses
+DEFAULT_ACTUATOR_QOS = {
+    'fans': 0,
+    'lights': 0,
+    'ph_pump': 1,
+    'nutrient_pump': 1,
+    'main_pump': 1,
+}
+
+
 @dataclass
 class MQTTConfig:
     """MQTT configuration."""
@@ -27,6 +50,12 @@ class MQTTConfig:
     topic_main_pump: str
     topic_lights: str
     topic_fans: str
+    
+    # Sensor payload encoding: 'json' or 'binary' (fixed-point struct frames)
+    wire_format: str = 'json'
+    
+    # Publish QoS per actuator name
+    actuator_qos: Dict[str, int] = field(default_factory=lambda: dict(DEFAULT_ACTUATOR_QOS))
 
 
 @dataclass
@@ -36,6 +65,8 @@ class InfluxDBConfig:
     token: str
     org: str
     bucket: str
+    batch_size: int = 500
+    flush_interval_ms: int = 1000
 
 
 @dataclass
@@ -64,6 +95,22 @@ class Config:
     control: ControlConfig
 
 
+@lru_cache(maxsize=None)
+def _load_env(env_file: Optional[str]) -> None:
+    """Load a .env file into the environment once per path."""
+    if env_file:
+        load_dotenv(env_file)
+    else:
+        load_dotenv()
+
+
+@lru_cache(maxsize=8)
+def _load_profile(profile_path: str, mtime_ns: int) -> Dict[str, Any]:
+    """Parse a crop profile; the mtime in the key invalidates edited files."""
+    with open(profile_path, 'r') as f:
+        return json.load(f)
+
+
 def load_config(env_file: Optional[str] = None) -> Config:
     """
     Load configuration from environment variables and a crop profile JSON file.
@@ -73,11 +120,16 @@ def load_config(env_file: Optional[str] = None) -> Config:
         
     Returns:
         Config object with all settings
+        
+    Raises:
+        ValueError: If WIRE_FORMAT is not a supported encoding
+        FileNotFoundError: If the crop profile does not exist
     """
-    if env_file:
-        load_dotenv(env_file)
-    else:
-        load_dotenv()
+    _load_env(env_file)
+    
+    wire_format = os.getenv('WIRE_FORMAT', 'json').lower()
+    if wire_format not in WIRE_FORMATS:
+        raise ValueError(f"WIRE_FORMAT must be one of {', '.join(WIRE_FORMATS)}, got {wire_format!r}")
     
     mqtt_config = MQTTConfig(
         broker=os.getenv('MQTT_BROKER', 'localhost'),
@@ -94,6 +146,11 @@ def load_config(env_file: Optional[str] = None) -> Config:
         topic_main_pump=os.getenv('MQTT_TOPIC_MAIN_PUMP', 'pfal/actuators/main_pump'),
         topic_lights=os.getenv('MQTT_TOPIC_LIGHTS', 'pfal/actuators/lights'),
         topic_fans=os.getenv('MQTT_TOPIC_FANS', 'pfal/actuators/fans'),
+        wire_format=wire_format,
+        actuator_qos={
+            actuator: int(os.getenv(f'MQTT_QOS_{actuator.upper()}', qos))
+            for actuator, qos in DEFAULT_ACTUATOR_QOS.items()
+        },
     )
     
     influxdb_config = InfluxDBConfig(
@@ -101,19 +158,20 @@ def load_config(env_file: Optional[str] = None) -> Config:
         token=os.getenv('INFLUXDB_TOKEN', ''),
         org=os.getenv('INFLUXDB_ORG', 'pfal'),
         bucket=os.getenv('INFLUXDB_BUCKET', 'pfal_sensors'),
+        batch_size=int(os.getenv('INFLUXDB_BATCH_SIZE', '500')),
+        flush_interval_ms=int(os.getenv('INFLUXDB_FLUSH_INTERVAL_MS', '1000')),
     )
 
     # Load control config from crop profile
     profile_name = os.getenv('CROP_PROFILE', 'default')
-    profile_path = os.path.join(
-        os.path.dirname(__file__), '..', '..', 'config', 'profiles', f'{profile_name}.json'
-    )
+    profile_path = os.path.join(PROFILES_DIR, f'{profile_name}.json')
 
-    if not os.path.exists(profile_path):
-        raise FileNotFoundError(f"Crop profile not found at: {profile_path}")
+    try:
+        mtime_ns = os.stat(profile_path).st_mtime_ns
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Crop profile not found at: {profile_path}") from None
 
-    with open(profile_path, 'r') as f:
-        profile_data = json.load(f)
+    profile_data = _load_profile(profile_path, mtime_ns)
 
     # Create ControlConfig from the loaded JSON data
     control_config = ControlConfig(**profile_data)
@@ -1,11 +1,16 @@
 """Main PFAL controller that orchestrates all components."""
+import argparse
+import atexit
 import logging
+import os
 import signal
 import sys
+import threading
 import time
+from datetime import datetime, timedelta
 from typing import Dict, Any
 
-from .config import load_config
+from .config import ACTUATORS, ControlConfig, load_config
 from .mqtt_client import MQTTClient
 from .influxdb_persistence import InfluxDBPersistence
 from .rule_controller import RuleBasedController
@@ -13,6 +18,31 @@ from .rule_controller import RuleBasedController
 
 logger = logging.getLogger(__name__)
 
+# Readings arriving within this window are folded into one rule evaluation
+EVALUATION_DEBOUNCE_S = 0.5
+
+# Upper bound on a single schedule wait, so a wall clock that jumps (e.g.
+# NTP syncing after boot on a Pi without an RTC) is picked up within the hour
+MAX_SCHEDULE_WAIT_S = 3600.0
+
+# How long a schedule check waits for the broker's retained actuator state
+# after (re)connecting before commanding the lights without it
+ACTUATOR_STATE_TIMEOUT_S = 5.0
+
+# One bit per actuator in the controller's last-command state masks
+_ACTUATOR_BITS = {actuator: 1 << i for i, actuator in enumerate(ACTUATORS)}
+
+
+def _immediate_eval_deltas(control: ControlConfig) -> Dict[str, float]:
+    """Change per signal beyond which a reading is evaluated without waiting
+    for the debounce."""
+    return {
+        'ph': control.ph_tolerance,
+        'ec': control.ec_tolerance,
+        'temperature': 2.0,  # Fan hysteresis band
+        'humidity': 5.0,     # Fan hysteresis band
+    }
+
 
 class PFALController:
     """Main controller for PFAL automation system."""
@@ -32,11 +62,53 @@ class PFALController:
         self.influxdb = InfluxDBPersistence(self.config.influxdb)
         self.rule_controller = RuleBasedController(self.config.control)
         
-        # Track last light state to avoid redundant commands
-        self.last_light_state = None
-        self.last_fan_state = None
+        # Last command sent to each stateful actuator, to avoid redundant publishes:
+        # a bit in _known_mask once the actuator was commanded, set in _on_mask if ON.
+        # Forgotten on each (re)connect, see _handle_connect().
+        self._known_mask = 0
+        self._on_mask = 0
+        self.mqtt_client.register_connect_callback(self._handle_connect)
+        
+        # Debounced rule evaluation state. A reading that moves by more than
+        # its delta since the last update is evaluated immediately.
+        self._immediate_eval_delta = _immediate_eval_deltas(self.config.control)
+        self._eval_lock = threading.Lock()
+        self._rules_lock = threading.Lock()
+        self._dirty_signals = set()
+        self._eval_timer = None
+        
+        # Per-sensor handlers: persist the reading and update the rule
+        # controller, returning True if rules should be evaluated right away
+        self._sensor_handlers = {
+            'ph': self._handle_ph,
+            'ec': self._handle_ec,
+            'temperature': self._handle_temperature,
+            'bme280': self._handle_bme280,
+        }
         
         self.running = False
+        self._stop_event = threading.Event()
+        # Set to run the schedule check before its next boundary (reconnect, stop)
+        self._schedule_wakeup = threading.Event()
+        self._atexit_registered = False
+        
+    def update_control_config(self, control: ControlConfig = None):
+        """
+        Apply a new (or mutated) control configuration at runtime.
+        
+        Refreshes the rule thresholds together with the values this
+        controller derives from the configuration.
+        
+        Args:
+            control: Replacement control configuration; None re-reads the current one
+        """
+        with self._rules_lock:
+            if control is not None:
+                self.config.control = control
+            self.rule_controller.update_config(self.config.control)
+            self._immediate_eval_delta = _immediate_eval_deltas(self.config.control)
+        # The lighting hours may have moved
+        self._schedule_wakeup.set()
         
     def _handle_sensor_data(self, sensor_type: str, data: Dict[str, Any]):
         """
@@ -48,104 +120,242 @@ class PFALController:
         """
         try:
             # Parse sensor data and persist to InfluxDB
-            if sensor_type == 'ph':
-                value = data.get('value')
-                if value is not None:
-                    sensor_id = data.get('sensor_id', 'default')
-                    self.influxdb.write_ph_reading(float(value), sensor_id)
-                    self.rule_controller.update_sensor_reading('ph', float(value))
-                    
-            elif sensor_type == 'ec':
-                value = data.get('value')
-                if value is not None:
-                    sensor_id = data.get('sensor_id', 'default')
-                    self.influxdb.write_ec_reading(float(value), sensor_id)
-                    self.rule_controller.update_sensor_reading('ec', float(value))
-                    
-            elif sensor_type == 'temperature':
-                value = data.get('value')
-                if value is not None:
-                    sensor_id = data.get('sensor_id', 'default')
-                    self.influxdb.write_temperature_reading(float(value), sensor_id)
-                    self.rule_controller.update_sensor_reading('temperature', float(value))
-                    
-            elif sensor_type == 'bme280':
-                temperature = data.get('temperature')
-                humidity = data.get('humidity')
-                pressure = data.get('pressure')
-                if all([temperature is not None, humidity is not None, pressure is not None]):
-                    sensor_id = data.get('sensor_id', 'default')
-                    self.influxdb.write_bme280_reading(
-                        float(temperature),
-                        float(humidity),
-                        float(pressure),
-                        sensor_id
-                    )
-                    # Also update temperature for control decisions
-                    self.rule_controller.update_sensor_reading('temperature', float(temperature))
-                    
-            # Evaluate control rules after each sensor update
-            self._evaluate_and_execute_rules()
+            handler = self._sensor_handlers.get(sensor_type)
+            if handler is None:
+                return
+            urgent = handler(data)
+            
+            # Evaluate large jumps right away, coalesce everything else
+            if urgent:
+                self._evaluate_now()
+            else:
+                self._schedule_evaluation()
             
         except Exception as e:
             logger.error(f"Error handling sensor data for {sensor_type}: {e}")
             
-    def _evaluate_and_execute_rules(self):
-        """Evaluate control rules and execute necessary actions."""
+    def _handle_ph(self, data: Dict[str, Any]) -> bool:
+        """Persist a pH reading and update the rule controller."""
+        value = data.get('value')
+        if value is None:
+            return False
+        value = float(value)
+        self.influxdb.write_ph_reading(value, data.get('sensor_id', 'default'))
+        return self._update_reading('ph', value)
+        
+    def _handle_ec(self, data: Dict[str, Any]) -> bool:
+        """Persist an EC reading and update the rule controller."""
+        value = data.get('value')
+        if value is None:
+            return False
+        value = float(value)
+        self.influxdb.write_ec_reading(value, data.get('sensor_id', 'default'))
+        return self._update_reading('ec', value)
+        
+    def _handle_temperature(self, data: Dict[str, Any]) -> bool:
+        """Persist a temperature reading and update the rule controller."""
+        value = data.get('value')
+        if value is None:
+            return False
+        value = float(value)
+        self.influxdb.write_temperature_reading(value, data.get('sensor_id', 'default'))
+        return self._update_reading('temperature', value)
+        
+    def _handle_bme280(self, data: Dict[str, Any]) -> bool:
+        """Persist a BME280 reading and update temperature and humidity."""
+        temperature = data.get('temperature')
+        humidity = data.get('humidity')
+        pressure = data.get('pressure')
+        if temperature is None or humidity is None or pressure is None:
+            return False
+        temperature = float(temperature)
+        humidity = float(humidity)
+        self.influxdb.write_bme280_reading(
+            temperature,
+            humidity,
+            float(pressure),
+            data.get('sensor_id', 'default')
+        )
+        # Also update temperature and humidity for control decisions,
+        # stamped with the same receive time
+        now = time.monotonic()
+        urgent = self._update_reading('temperature', temperature, now)
+        urgent |= self._update_reading('humidity', humidity, now)
+        return urgent
+        
+    def _update_reading(self, sensor_type: str, value: float, ts: float = None) -> bool:
+        """
+        Update a reading in the rule controller.
+        
+        Readings the rule controller coalesces do not mark the signal dirty.
+        
+        Args:
+            sensor_type: Type of sensor
+            value: Sensor value
+            ts: Optional time.monotonic() receive time shared by a composite reading
+            
+        Returns:
+            True if the reading is new or jumped by more than its immediate
+            evaluation delta, meaning rules should not wait for the debounce
+        """
+        previous = self.rule_controller.last_sensor_readings.get(sensor_type)
+        if not self.rule_controller.update_sensor_reading(sensor_type, value, ts):
+            return False
+        with self._eval_lock:
+            self._dirty_signals.add(sensor_type)
+        if previous is None:
+            return True
+        return abs(value - previous[0]) > self._immediate_eval_delta.get(sensor_type, 0.0)
+        
+    def _schedule_evaluation(self):
+        """Evaluate rules for dirty signals once the debounce window ends."""
+        with self._eval_lock:
+            # Readings drained during shutdown are persisted but not acted on
+            if self._stop_event.is_set():
+                return
+            if self._dirty_signals and self._eval_timer is None:
+                self._eval_timer = threading.Timer(EVALUATION_DEBOUNCE_S, self._maybe_evaluate)
+                self._eval_timer.daemon = True
+                self._eval_timer.start()
+                
+    def _maybe_evaluate(self):
+        """Debounce timer callback: evaluate rules if readings changed."""
+        with self._eval_lock:
+            self._eval_timer = None
+        self._evaluate_now()
+        
+    def _evaluate_now(self):
+        """Evaluate rules for all dirty signals, absorbing any pending debounced run."""
+        with self._eval_lock:
+            if self._stop_event.is_set():
+                return
+            signals, self._dirty_signals = self._dirty_signals, set()
+        if signals:
+            self._evaluate_and_execute_rules(signals)
+            
+    def _evaluate_and_execute_rules(self, signals):
+        """Evaluate the control rules depending on the given signals and execute actions."""
+        with self._rules_lock:
+            self._execute_rules(signals)
+            
+    def _execute_rules(self, signals):
+        """Evaluate control rules for the given signals and publish the resulting commands."""
         try:
-            commands = self.rule_controller.evaluate_all_rules()
+            # Only rules fed by the updated sensors; lighting runs from the schedule
+            final_commands = self.rule_controller.evaluate_for(*signals)
             
-            for command in commands:
-                action = command.get('action')
-                cmd = command.get('command')
-                duration_ms = command.get('duration_ms')
-                reason = command.get('reason')
+            to_publish = []
+            for command in final_commands:
+                # Avoid redundant actuator commands
+                if self._is_redundant(command.action, command.command, command.duration_ms):
+                    continue
                 
-                # Avoid redundant light commands
-                if action == 'lights':
-                    if self.last_light_state == cmd:
-                        continue
-                    self.last_light_state = cmd
-                    
-                # Avoid redundant fan commands
-                if action == 'fans':
-                    if self.last_fan_state == cmd:
-                        continue
-                    self.last_fan_state = cmd
+                logger.info("Executing action: %s -> %s (Reason: %s)",
+                            command.action, command.command, command.reason)
+                to_publish.append(command)
                 
-                logger.info(f"Executing action: {action} -> {cmd} (Reason: {reason})")
-                self.mqtt_client.publish_command(action, cmd, duration_ms)
+            if to_publish:
+                published = self.mqtt_client.publish_commands(to_publish)
+                for command, ok in zip(to_publish, published):
+                    if ok:
+                        self._record_command(command.action, command.command, command.duration_ms)
                 
         except Exception as e:
             logger.error(f"Error evaluating rules: {e}")
             
+    def _is_redundant(self, action: str, cmd: str, duration_ms: int = None) -> bool:
+        """
+        Check whether a command would leave its actuator unchanged.
+        
+        Timed commands (pump doses) are never redundant: an identical dose
+        must still be delivered each time a rule asks for it. Unknown
+        actuators have no state bit and are never redundant either. Until
+        a command to an actuator is recorded, the state retained on the
+        broker, if any, is used instead.
+        """
+        if duration_ms is not None:
+            return False
+        bit = _ACTUATOR_BITS.get(action, 0)
+        if not self._known_mask & bit:
+            retained = self.mqtt_client.get_retained_command(action)
+            if retained is not None:
+                self._record_command(action, retained)
+        desired = bit if cmd == 'ON' else 0
+        return bool(self._known_mask & bit) and self._on_mask & bit == desired
+        
+    def _record_command(self, action: str, cmd: str, duration_ms: int = None):
+        """
+        Record the state an actuator was commanded to.
+        
+        Only called once the command was published, so a command lost while
+        the broker is unreachable is not taken as the actuator state.
+        """
+        if duration_ms is not None:
+            return
+        bit = _ACTUATOR_BITS.get(action, 0)
+        self._known_mask |= bit
+        self._on_mask = (self._on_mask & ~bit) | (bit if cmd == 'ON' else 0)
+        
+    def _handle_connect(self):
+        """
+        Forget the recorded actuator state when the MQTT client (re)connects.
+        
+        Commands published with QoS 0 while disconnected were lost, so every
+        actuator is commanded again, and the lighting schedule re-checked.
+        """
+        with self._rules_lock:
+            self._known_mask = 0
+            self._on_mask = 0
+            self.rule_controller.reset_lighting_schedule()
+        self._schedule_wakeup.set()
+        
+    def _seconds_until_next_light_switch(self, now: datetime) -> float:
+        """Return the number of seconds until the next lights on/off boundary."""
+        boundaries = []
+        for hour in (self.config.control.lights_on_hour, self.config.control.lights_off_hour):
+            boundary = now.replace(hour=hour % 24, minute=0, second=0, microsecond=0)
+            if boundary <= now:
+                boundary += timedelta(days=1)
+            boundaries.append(boundary)
+        return (min(boundaries) - now).total_seconds()
+        
     def _periodic_schedule_check(self):
-        """Periodically check schedule-based rules (like lighting)."""
-        while self.running:
+        """Apply schedule-based rules (like lighting) at each schedule boundary and reconnect."""
+        while not self._stop_event.is_set():
+            self._schedule_wakeup.clear()
+            # _is_redundant() compares against the retained state, so let it arrive first
+            if not self.mqtt_client.wait_for_actuator_state(ACTUATOR_STATE_TIMEOUT_S):
+                logger.warning("Retained actuator state not received from the MQTT broker yet")
             try:
-                # Check lighting schedule
-                light_command = self.rule_controller.evaluate_lighting_schedule()
-                if light_command:
-                    action = light_command.get('action')
-                    cmd = light_command.get('command')
-                    
-                    # Only send if state changed
-                    if self.last_light_state != cmd:
-                        reason = light_command.get('reason')
-                        logger.info(f"Executing scheduled action: {action} -> {cmd} (Reason: {reason})")
-                        self.mqtt_client.publish_command(action, cmd)
-                        self.last_light_state = cmd
+                with self._rules_lock:
+                    # Check lighting schedule
+                    light_command = self.rule_controller.evaluate_lighting_schedule()
+                    if light_command:
+                        action = light_command.action
+                        cmd = light_command.command
+                        
+                        # Only send if state changed
+                        if not self._is_redundant(action, cmd):
+                            reason = light_command.reason
+                            logger.info("Executing scheduled action: %s -> %s (Reason: %s)", action, cmd, reason)
+                            if self.mqtt_client.publish_command(action, cmd):
+                                self._record_command(action, cmd)
+                            else:
+                                # Retry at the next check rather than the next boundary
+                                self.rule_controller.reset_lighting_schedule()
                         
             except Exception as e:
                 logger.error(f"Error in periodic schedule check: {e}")
                 
-            # Check schedule every 60 seconds
-            time.sleep(60)
+            # Sleep until the next lighting boundary, a reconnect, or until stopped
+            wait_s = self._seconds_until_next_light_switch(datetime.now())
+            self._schedule_wakeup.wait(min(wait_s, MAX_SCHEDULE_WAIT_S))
             
     def start(self):
         """Start the PFAL controller."""
-        logger.info("Starting PFAL Controller...")
+        logger.info(f"Starting PFAL Controller with profile: {self.config.control.profile_name}")
         
+        self._stop_event.clear()
         try:
             # Connect to InfluxDB
             self.influxdb.connect()
@@ -153,17 +363,22 @@ class PFALController:
             # Connect to MQTT broker
             self.mqtt_client.connect()
             
-            # Register sensor callbacks
-            self.mqtt_client.register_sensor_callback('ph', self._handle_sensor_data)
-            self.mqtt_client.register_sensor_callback('ec', self._handle_sensor_data)
-            self.mqtt_client.register_sensor_callback('temperature', self._handle_sensor_data)
-            self.mqtt_client.register_sensor_callback('bme280', self._handle_sensor_data)
+            # Register sensor callbacks for every sensor type with a handler
+            for sensor_type in self._sensor_handlers:
+                self.mqtt_client.register_sensor_callback(sensor_type, self._handle_sensor_data)
             
             self.running = True
             
             logger.info("PFAL Controller started successfully")
             
-            # Run periodic schedule checks
+            # Make sure buffered InfluxDB points are flushed even if the
+            # interpreter exits without going through the signal handler
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+            
+            # MQTT traffic is handled by the client's own threads, so the main
+            # thread runs the schedule checks until stop() sets the event
             self._periodic_schedule_check()
             
         except Exception as e:
@@ -172,10 +387,26 @@ class PFALController:
             raise
             
     def stop(self):
-        """Stop the PFAL controller."""
+        """
+        Stop the PFAL controller.
+        
+        Also releases the connections of a start() that failed part way.
+        Calls after the first one (e.g. from atexit) do nothing.
+        """
+        if self._stop_event.is_set():
+            return
+            
         logger.info("Stopping PFAL Controller...")
         
         self.running = False
+        self._stop_event.set()
+        self._schedule_wakeup.set()
+        
+        # Drop any pending debounced evaluation
+        with self._eval_lock:
+            if self._eval_timer is not None:
+                self._eval_timer.cancel()
+                self._eval_timer = None
         
         # Disconnect MQTT
         try:
@@ -183,7 +414,7 @@ class PFALController:
         except Exception as e:
             logger.error(f"Error disconnecting MQTT client: {e}")
             
-        # Disconnect InfluxDB
+        # Disconnect InfluxDB (flushes any buffered points)
         try:
             self.influxdb.disconnect()
         except Exception as e:
@@ -197,40 +428,56 @@ def setup_logging(log_level=logging.INFO):
     logging.basicConfig(
         level=log_level,
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(sys.stdout),
-            logging.FileHandler('/var/log/pfal_controller.log', mode='a')
-        ]
+        stream=sys.stdout # Log to stdout by default
     )
+    # File handler can be added here if needed, but consider permissions
+    # handlers=[
+    #     logging.StreamHandler(sys.stdout),
+    #     logging.FileHandler('/var/log/pfal_controller.log', mode='a')
+    # ]
 
 
-def signal_handler(signum, frame):
-    """Handle shutdown signals."""
-    logger.info(f"Received signal {signum}, shutting down...")
-    sys.exit(0)
+def signal_handler(controller: PFALController):
+    def handler(signum, frame):
+        """Handle shutdown signals."""
+        logger.info(f"Received signal {signum}, shutting down...")
+        controller.stop()
+        sys.exit(0)
+    return handler
 
 
-def main():
-    """Main entry point for PFAL controller."""
+def main(argv=None):
+    """
+    Main entry point for PFAL controller.
+    
+    Args:
+        argv: Command line arguments (defaults to sys.argv[1:])
+    """
+    parser = argparse.ArgumentParser(description='PFAL Controller - Rule-based automation')
+    parser.add_argument('--config', type=str, help='Path to configuration file')
+    args = parser.parse_args(argv)
+    
     # Set up logging
     setup_logging()
     
-    # Set up signal handlers for graceful shutdown
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+    # Create controller instance (--config takes precedence over CONFIG_FILE)
+    config_file = args.config or os.getenv('CONFIG_FILE')
+    controller = PFALController(config_file=config_file)
     
-    # Create and start controller
-    controller = PFALController()
+    # Set up signal handlers for graceful shutdown
+    shutdown_handler = signal_handler(controller)
+    signal.signal(signal.SIGINT, shutdown_handler)
+    signal.signal(signal.SIGTERM, shutdown_handler)
     
     try:
         controller.start()
     except KeyboardInterrupt:
         logger.info("Received keyboard interrupt")
     except Exception as e:
-        logger.error(f"Unexpected error: {e}")
+        logger.error(f"Unexpected error: {e}", exc_info=True)
     finally:
         controller.stop()
 
 
 if __name__ == '__main__':
-    main()
+    main()
\ No newline at end of file
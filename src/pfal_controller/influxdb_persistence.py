@@ -1,9 +1,11 @@
 """InfluxDB persistence module for sensor data."""
 import logging
-from datetime import datetime
-from typing import Dict, Any
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
+import math
+import time
+from functools import lru_cache
+from typing import Dict, Any, Optional
+from influxdb_client import InfluxDBClient, Point, WritePrecision
+from influxdb_client.client.write_api import WriteOptions, WriteType
 
 from .config import InfluxDBConfig
 
@@ -11,6 +13,59 @@ from .config import InfluxDBConfig
 logger = logging.getLogger(__name__)
 
 
+def _batch_write_options(config: InfluxDBConfig) -> WriteOptions:
+    """Write options that buffer points and flush them in a single HTTP
+    request per batch instead of one request per sensor reading."""
+    return WriteOptions(
+        write_type=WriteType.batching,
+        batch_size=config.batch_size,
+        flush_interval=config.flush_interval_ms,
+        jitter_interval=500,
+        retry_interval=5000,
+    )
+
+
+# Sensors report every few seconds, so second precision is enough and keeps
+# timestamps 9 digits shorter than the nanosecond default
+WRITE_PRECISION = WritePrecision.S
+
+# Line protocol templates for the fixed-shape sensor measurements. Writing
+# these strings directly skips building a Point and re-serializing it.
+# Fields are in Point's (sorted) order so both paths produce the same line.
+_LP_VALUE = "{key} value={v} {ts}".format
+_LP_BME280 = "{key} humidity={h},pressure={p},temperature={t} {ts}".format
+
+# Same tag escapes as influxdb-client's Point
+_TAG_ESCAPES = str.maketrans({',': '\\,', '=': '\\=', ' ': '\\ ', '\n': '\\n', '\t': '\\t', '\r': '\\r'})
+
+
+@lru_cache(maxsize=64)
+def _series_key(measurement: str, sensor_id: str) -> str:
+    """Escaped ``measurement,sensor_id=...`` prefix, built once per sensor."""
+    tag = sensor_id.translate(_TAG_ESCAPES)
+    if tag.endswith('\\'):
+        # A trailing backslash would escape the separator after the tag
+        tag += ' '
+    return f"{measurement},sensor_id={tag}"
+
+
+def _lp_float(value: float) -> str:
+    """Format a float field like Point, which drops a trailing ``.0``."""
+    s = repr(value)
+    return s[:-2] if s.endswith('.0') else s
+
+
+def _is_plain(sensor_id: Any, *values: float) -> bool:
+    """Check whether a reading can be written with a line protocol template.
+    
+    Empty/non-string tags, non-float values (ints are integer fields to
+    Point) and non-finite values need the handling done by Point, so those
+    fall back to write_sensor_data().
+    """
+    return (isinstance(sensor_id, str) and sensor_id != ''
+            and all(type(v) is float and math.isfinite(v) for v in values))
+
+
 class InfluxDBPersistence:
     """Handles persistence of sensor data to InfluxDB 2."""
     
@@ -31,22 +86,35 @@ class InfluxDBPersistence:
             self.client = InfluxDBClient(
                 url=self.config.url,
                 token=self.config.token,
-                org=self.config.org
+                org=self.config.org,
+                # Batched line protocol is highly repetitive and compresses well
+                enable_gzip=True,
+            )
+            self.write_api = self.client.write_api(
+                write_options=_batch_write_options(self.config),
+                error_callback=self._on_write_error,
             )
-            self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
             logger.info(f"Connected to InfluxDB at {self.config.url}")
         except Exception as e:
             logger.error(f"Failed to connect to InfluxDB: {e}")
             raise
             
     def disconnect(self):
-        """Close connection to InfluxDB."""
+        """Flush buffered points and close connection to InfluxDB."""
+        if self.write_api:
+            # Closing the batching write API flushes any pending points
+            self.write_api.close()
+            self.write_api = None
         if self.client:
             self.client.close()
             logger.info("Disconnected from InfluxDB")
             
+    def _on_write_error(self, conf, data, exception):
+        """Callback for batches that could not be written to InfluxDB."""
+        logger.error(f"Failed to write batch to InfluxDB: {exception}")
+            
     def write_sensor_data(self, measurement: str, tags: Dict[str, str], 
-                         fields: Dict[str, Any], timestamp: datetime = None):
+                         fields: Dict[str, Any], timestamp: Optional[int] = None):
         """
         Write sensor data to InfluxDB.
         
@@ -54,7 +122,11 @@ class InfluxDBPersistence:
             measurement: Measurement name (e.g., 'ph', 'ec', 'temperature')
             tags: Dictionary of tags (e.g., {'sensor_id': 'esp32_1', 'location': 'zone_a'})
             fields: Dictionary of field values (e.g., {'value': 6.5})
-            timestamp: Optional timestamp (defaults to current time)
+            timestamp: Optional Unix timestamp in seconds (defaults to current time)
+            
+        Points are queued on the batching write API and sent to InfluxDB
+        asynchronously, so the timestamp is taken here rather than left to
+        the server.
         """
         if not self.write_api:
             logger.error("InfluxDB write API not initialized")
@@ -71,50 +143,70 @@ class InfluxDBPersistence:
             for field_key, field_value in fields.items():
                 point.field(field_key, field_value)
             
-            # Set timestamp if provided
-            if timestamp:
-                point.time(timestamp)
+            # Stamp the point now, it may be flushed up to a batch later
+            if timestamp is None:
+                timestamp = int(time.time())
+            point.time(timestamp, WRITE_PRECISION)
             
-            # Write to InfluxDB
-            self.write_api.write(bucket=self.config.bucket, record=point)
-            logger.debug(f"Wrote {measurement} data to InfluxDB: {fields}")
+            # Queue for the next batched write to InfluxDB
+            self.write_api.write(bucket=self.config.bucket, record=point,
+                                 write_precision=WRITE_PRECISION)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Queued %s data for InfluxDB: %s", measurement, fields)
             
         except Exception as e:
             logger.error(f"Failed to write data to InfluxDB: {e}")
             
+    def _write_line(self, line: str):
+        """Queue a pre-formatted line protocol record on the batching write API."""
+        if not self.write_api:
+            logger.error("InfluxDB write API not initialized")
+            return
+            
+        try:
+            self.write_api.write(bucket=self.config.bucket, record=line,
+                                 write_precision=WRITE_PRECISION)
+        except Exception as e:
+            logger.error(f"Failed to write data to InfluxDB: {e}")
+            return
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Queued line for InfluxDB: %s", line)
+        
     def write_ph_reading(self, ph_value: float, sensor_id: str = "default"):
         """Write pH sensor reading."""
-        self.write_sensor_data(
-            measurement="ph",
-            tags={"sensor_id": sensor_id},
-            fields={"value": ph_value}
-        )
+        if not _is_plain(sensor_id, ph_value):
+            self.write_sensor_data("ph", {"sensor_id": sensor_id}, {"value": ph_value})
+            return
+        self._write_line(_LP_VALUE(key=_series_key("ph", sensor_id), v=_lp_float(ph_value), ts=int(time.time())))
         
     def write_ec_reading(self, ec_value: float, sensor_id: str = "default"):
         """Write EC sensor reading."""
-        self.write_sensor_data(
-            measurement="ec",
-            tags={"sensor_id": sensor_id},
-            fields={"value": ec_value}
-        )
+        if not _is_plain(sensor_id, ec_value):
+            self.write_sensor_data("ec", {"sensor_id": sensor_id}, {"value": ec_value})
+            return
+        self._write_line(_LP_VALUE(key=_series_key("ec", sensor_id), v=_lp_float(ec_value), ts=int(time.time())))
         
     def write_temperature_reading(self, temp_value: float, sensor_id: str = "default"):
         """Write temperature sensor reading."""
-        self.write_sensor_data(
-            measurement="temperature",
-            tags={"sensor_id": sensor_id},
-            fields={"value": temp_value}
-        )
+        if not _is_plain(sensor_id, temp_value):
+            self.write_sensor_data("temperature", {"sensor_id": sensor_id}, {"value": temp_value})
+            return
+        self._write_line(_LP_VALUE(key=_series_key("temperature", sensor_id), v=_lp_float(temp_value),
+                                   ts=int(time.time())))
         
     def write_bme280_reading(self, temperature: float, humidity: float, 
                             pressure: float, sensor_id: str = "default"):
         """Write BME280 sensor reading (temperature, humidity, pressure)."""
-        self.write_sensor_data(
-            measurement="bme280",
-            tags={"sensor_id": sensor_id},
-            fields={
-                "temperature": temperature,
-                "humidity": humidity,
-                "pressure": pressure
-            }
-        )
+        if not _is_plain(sensor_id, temperature, humidity, pressure):
+            self.write_sensor_data(
+                measurement="bme280",
+                tags={"sensor_id": sensor_id},
+                fields={
+                    "temperature": temperature,
+                    "humidity": humidity,
+                    "pressure": pressure
+                }
+            )
+            return
+        self._write_line(_LP_BME280(key=_series_key("bme280", sensor_id), t=_lp_float(temperature),
+                                    h=_lp_float(humidity), p=_lp_float(pressure), ts=int(time.time())))
@@ -1,14 +1,78 @@
 """MQTT client for sensor data and actuator control."""
 import logging
-import json
-from typing import Callable, Optional, Dict, Any
+import socket
+import struct
+import threading
+from collections import deque
+from enum import IntEnum
+from typing import Callable, Optional, Dict, Any, List, Tuple, Union
+import orjson
 import paho.mqtt.client as mqtt
 
-from .config import MQTTConfig
+from .config import ACTUATORS, MQTTConfig
 
 
 logger = logging.getLogger(__name__)
 
+# Binary sensor frames (WIRE_FORMAT=binary), little-endian fixed point.
+# Single-value sensors: int16 value*100, uint8 node index.
+# BME280: int16 temperature*100, uint16 humidity*100, uint16 pressure*10, uint8 node index.
+VALUE_FRAME = struct.Struct('<hB')
+BME280_FRAME = struct.Struct('<hHHB')
+
+# Decoded sensor messages buffered between the network thread and the
+# dispatch thread. When full, the oldest message is dropped: a newer
+# reading of the same sensor supersedes it anyway.
+RX_QUEUE_MAXLEN = 1000
+
+
+class SensorType(IntEnum):
+    """Sensor types carried on the sensor topics, usable as list indices."""
+    PH = 0
+    EC = 1
+    TEMPERATURE = 2
+    BME280 = 3
+
+
+# Callback-facing sensor type names, indexed by SensorType
+SENSOR_NAMES = ('ph', 'ec', 'temperature', 'bme280')
+_NAME_TO_IDX = {name: SensorType(idx) for idx, name in enumerate(SENSOR_NAMES)}
+
+# Pre-serialized payloads for plain (untimed) actuator commands
+_COMMAND_PAYLOADS = {
+    'ON': b'{"command":"ON"}',
+    'OFF': b'{"command":"OFF"}',
+}
+
+
+def decode_binary_payload(payload: bytes, bme280: bool = False) -> Dict[str, Any]:
+    """
+    Decode a binary sensor frame into the same shape as a JSON payload.
+    
+    Args:
+        payload: Raw MQTT payload
+        bme280: Whether the frame is a BME280 frame
+        
+    Returns:
+        Sensor data dictionary with a sensor_id of 'esp32_<node index>'
+        
+    Raises:
+        ValueError: If the payload is not exactly one frame long
+    """
+    frame = BME280_FRAME if bme280 else VALUE_FRAME
+    if len(payload) != frame.size:
+        raise ValueError(f"Expected a {frame.size} byte frame, got {len(payload)} bytes")
+    if bme280:
+        temperature, humidity, pressure, node = BME280_FRAME.unpack(payload)
+        return {
+            'temperature': temperature / 100,
+            'humidity': humidity / 100,
+            'pressure': pressure / 10,
+            'sensor_id': f'esp32_{node}',
+        }
+    value, node = VALUE_FRAME.unpack(payload)
+    return {'value': value / 100, 'sensor_id': f'esp32_{node}'}
+
 
 class MQTTClient:
     """Handles MQTT communication for sensors and actuators."""
@@ -21,68 +85,211 @@ class MQTTClient:
             config: MQTT configuration
         """
         self.config = config
-        self.client = mqtt.Client(client_id=config.client_id)
-        self.sensor_callbacks = {}
+        self.client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
+            client_id=config.client_id,
+            clean_session=True,
+        )
+        # Tuple of callbacks per SensorType, replaced (never mutated) on registration
+        self._callbacks: List[Tuple[Callable, ...]] = [()] * len(SensorType)
+        self._connect_callbacks: Tuple[Callable, ...] = ()
         self.connected = False
         
+        # Hand-off from paho's network thread to the sensor dispatch thread
+        self._rx_queue = deque(maxlen=RX_QUEUE_MAXLEN)
+        self._rx_ready = threading.Condition()
+        self._rx_dropped = 0
+        self._rx_thread: Optional[threading.Thread] = None
+        self._stopping = False
+        
+        # Topic routing tables, built once from the (immutable) config
+        self._topic_dispatch = {
+            config.topic_ph: SensorType.PH,
+            config.topic_ec: SensorType.EC,
+            config.topic_temp: SensorType.TEMPERATURE,
+            config.topic_bme280: SensorType.BME280,
+        }
+        # Kept as str: paho's publish() always calls topic.encode() itself
+        self._actuator_topics = {actuator: getattr(config, f'topic_{actuator}') for actuator in ACTUATORS}
+        self._actuator_by_topic = {topic: actuator for actuator, topic in self._actuator_topics.items()}
+        # Untimed command per actuator retained on the broker, as delivered on subscribe
+        self._retained_commands: Dict[str, str] = {}
+        # Set once the retained actuator messages have been delivered (see _subscribe)
+        self._actuator_state_ready = threading.Event()
+        self._sensor_subscribe_mid: Optional[int] = None
+        
         # Set up callbacks
         self.client.on_connect = self._on_connect
         self.client.on_disconnect = self._on_disconnect
         self.client.on_message = self._on_message
+        self.client.on_subscribe = self._on_subscribe
+        
+        # Allow several acknowledged (QoS 1) commands in flight at once, and keep
+        # the outgoing queue bounded so it stays cheap to flush after a reconnect
+        self.client.max_inflight_messages_set(20)
+        self.client.max_queued_messages_set(1000)
+        self.client.reconnect_delay_set(min_delay=1, max_delay=16)
         
         # Set authentication if provided
         if config.username and config.password:
             self.client.username_pw_set(config.username, config.password)
             
-    def _on_connect(self, client, userdata, flags, rc):
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
         """Callback for when the client connects to the broker."""
-        if rc == 0:
+        if reason_code == 0:
             self.connected = True
             logger.info(f"Connected to MQTT broker at {self.config.broker}:{self.config.port}")
             
-            # Subscribe to all sensor topics
-            self._subscribe_to_sensors()
+            # Actuator commands are tiny; send them without Nagle delays
+            self._disable_nagle()
+            
+            # Subscribe to actuator topics for their retained state, which is
+            # delivered afresh, and to all sensor topics
+            self._retained_commands.clear()
+            self._actuator_state_ready.clear()
+            self._subscribe()
+            
+            for callback in self._connect_callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"Error in connect callback: {e}")
         else:
-            logger.error(f"Failed to connect to MQTT broker, return code: {rc}")
+            logger.error(f"Failed to connect to MQTT broker, reason: {reason_code}")
+            
+    def _on_subscribe(self, client, userdata, mid, reason_code_list, properties):
+        """Callback for when the broker acknowledges a subscription."""
+        if mid == self._sensor_subscribe_mid:
+            self._actuator_state_ready.set()
             
-    def _on_disconnect(self, client, userdata, rc):
+    def _disable_nagle(self):
+        """Set TCP_NODELAY on the broker connection, where the transport allows it."""
+        sock = self.client.socket()
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (AttributeError, OSError) as e:
+            logger.debug(f"Could not set TCP_NODELAY on MQTT socket: {e}")
+            
+    def _on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
         """Callback for when the client disconnects from the broker."""
         self.connected = False
-        if rc != 0:
-            logger.warning(f"Unexpected disconnect from MQTT broker, return code: {rc}")
+        if reason_code != 0:
+            logger.warning(f"Unexpected disconnect from MQTT broker, reason: {reason_code}")
         else:
             logger.info("Disconnected from MQTT broker")
             
     def _on_message(self, client, userdata, msg):
-        """Callback for when a message is received."""
+        """
+        Callback for when a message is received.
+        
+        Sensor payloads are UTF-8 JSON objects, or a bare number that is
+        treated as {'value': n}. With WIRE_FORMAT=binary every sensor topic
+        carries a binary frame instead (see decode_binary_payload).
+        Retained messages on actuator topics, delivered when subscribing,
+        record the actuator state held by the broker. Live actuator messages,
+        including the broker echoing our own publishes, are ignored.
+        """
         try:
             topic = msg.topic
-            payload = msg.payload.decode('utf-8')
-            logger.debug(f"Received message on topic {topic}: {payload}")
+            sensor_type = self._topic_dispatch.get(topic)
+            if sensor_type is None:
+                actuator = self._actuator_by_topic.get(topic)
+                if actuator is None:
+                    logger.warning(f"Received message on unknown topic: {topic}")
+                elif msg.retain:
+                    self._record_actuator_state(actuator, msg.payload)
+                return
             
-            # Parse JSON payload
-            try:
-                data = json.loads(payload)
-            except json.JSONDecodeError:
-                # If not JSON, treat as plain value
-                data = {'value': float(payload)}
-            
-            # Determine sensor type and call appropriate callback
-            if topic == self.config.topic_ph:
-                self._handle_sensor_data('ph', data)
-            elif topic == self.config.topic_ec:
-                self._handle_sensor_data('ec', data)
-            elif topic == self.config.topic_temp:
-                self._handle_sensor_data('temperature', data)
-            elif topic == self.config.topic_bme280:
-                self._handle_sensor_data('bme280', data)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Received message on topic %s: %r", topic, msg.payload)
+            
+            if self.config.wire_format == 'binary':
+                try:
+                    data = decode_binary_payload(msg.payload, bme280=(sensor_type == SensorType.BME280))
+                except ValueError as e:
+                    logger.warning(f"Ignoring malformed frame on topic {topic}: {e}")
+                    return
             else:
-                logger.warning(f"Received message on unknown topic: {topic}")
+                # Parse JSON payload (orjson reads the raw bytes directly)
+                try:
+                    data = orjson.loads(msg.payload)
+                except orjson.JSONDecodeError:
+                    # If not JSON, treat as plain value (float() parses bytes directly)
+                    try:
+                        data = {'value': float(msg.payload)}
+                    except ValueError:
+                        logger.warning(f"Ignoring unparseable payload on topic {topic}: {msg.payload!r}")
+                        return
+                if not isinstance(data, dict):
+                    # Bare JSON number
+                    data = {'value': data}
+            
+            self._enqueue_sensor_data(sensor_type, data)
                 
         except Exception as e:
             logger.error(f"Error processing MQTT message: {e}")
             
-    def _handle_sensor_data(self, sensor_type: str, data: Dict[str, Any]):
+    def _record_actuator_state(self, actuator: str, payload: bytes):
+        """
+        Remember the command retained on an actuator topic.
+        
+        Timed commands are not state and are ignored; an empty (cleared
+        retained) payload forgets the state.
+        
+        Args:
+            actuator: Actuator name
+            payload: Raw command payload
+        """
+        if not payload:
+            self._retained_commands.pop(actuator, None)
+            return
+        try:
+            data = orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            logger.warning(f"Ignoring unparseable command on {actuator} topic: {payload!r}")
+            return
+        if isinstance(data, dict) and 'duration_ms' not in data and isinstance(data.get('command'), str):
+            self._retained_commands[actuator] = data['command']
+            
+    def _enqueue_sensor_data(self, sensor_type: SensorType, data: Dict[str, Any]):
+        """Queue decoded sensor data for the dispatch thread, dropping the oldest if full."""
+        with self._rx_ready:
+            if len(self._rx_queue) == RX_QUEUE_MAXLEN:
+                self._rx_dropped += 1
+                if self._rx_dropped == 1 or self._rx_dropped % RX_QUEUE_MAXLEN == 0:
+                    logger.warning(f"Sensor queue full, dropped oldest message ({self._rx_dropped} dropped so far)")
+            self._rx_queue.append((sensor_type, data))
+            self._rx_ready.notify()
+            
+    def _dispatch_sensor_data(self):
+        """Run sensor callbacks for queued messages until stopped and drained."""
+        while True:
+            with self._rx_ready:
+                while not self._rx_queue and not self._stopping:
+                    self._rx_ready.wait()
+                if not self._rx_queue:
+                    return
+                sensor_type, data = self._rx_queue.popleft()
+            self._handle_sensor_data(sensor_type, data)
+            
+    def _start_dispatch(self):
+        """Start the sensor dispatch thread if it is not already running."""
+        if self._rx_thread is not None and self._rx_thread.is_alive():
+            return
+        self._stopping = False
+        self._rx_thread = threading.Thread(target=self._dispatch_sensor_data, name='mqtt-sensor-dispatch', daemon=True)
+        self._rx_thread.start()
+        
+    def _stop_dispatch(self):
+        """Stop the sensor dispatch thread after it drains the queue."""
+        with self._rx_ready:
+            self._stopping = True
+            self._rx_ready.notify()
+        if self._rx_thread is not None:
+            self._rx_thread.join(timeout=5.0)
+            self._rx_thread = None
+            
+    def _handle_sensor_data(self, sensor_type: SensorType, data: Dict[str, Any]):
         """
         Handle sensor data by calling registered callbacks.
         
@@ -90,30 +297,43 @@ class MQTTClient:
             sensor_type: Type of sensor
             data: Sensor data dictionary
         """
-        if sensor_type in self.sensor_callbacks:
-            for callback in self.sensor_callbacks[sensor_type]:
-                try:
-                    callback(sensor_type, data)
-                except Exception as e:
-                    logger.error(f"Error in sensor callback for {sensor_type}: {e}")
+        name = SENSOR_NAMES[sensor_type]
+        for callback in self._callbacks[sensor_type]:
+            try:
+                callback(name, data)
+            except Exception as e:
+                logger.error(f"Error in sensor callback for {name}: {e}")
                     
-    def _subscribe_to_sensors(self):
-        """Subscribe to all sensor topics."""
-        topics = [
+    def _subscribe(self):
+        """
+        Subscribe to the actuator topics, then to all sensor topics in a single SUBSCRIBE packet.
+        
+        The broker processes the two packets in order, so it has delivered
+        the retained actuator messages queued by the first one before it
+        acknowledges the second. That SUBACK therefore marks the actuator
+        state as complete, and no sensor reading can arrive before it.
+        """
+        actuator_topics = [(topic, 0) for topic in self._actuator_topics.values()]
+        sensor_topics = [
             (self.config.topic_ph, 0),
             (self.config.topic_ec, 0),
             (self.config.topic_temp, 0),
             (self.config.topic_bme280, 0),
         ]
         
-        for topic, qos in topics:
-            self.client.subscribe(topic, qos)
-            logger.info(f"Subscribed to topic: {topic}")
+        self.client.subscribe(actuator_topics)
+        self._sensor_subscribe_mid = self.client.subscribe(sensor_topics)[1]
+        logger.info(f"Subscribed to topics: {', '.join(topic for topic, _ in actuator_topics + sensor_topics)}")
             
     def connect(self):
         """Connect to MQTT broker."""
         try:
+            self._start_dispatch()
             self.client.connect(self.config.broker, self.config.port, 60)
+            # Keep paho's own network thread: commands are published from the
+            # dispatch and evaluation threads, and only with loop_start() does
+            # paho hand their writes to one thread instead of writing the
+            # socket from each caller
             self.client.loop_start()
             logger.info(f"Connecting to MQTT broker at {self.config.broker}:{self.config.port}")
         except Exception as e:
@@ -123,59 +343,127 @@ class MQTTClient:
     def disconnect(self):
         """Disconnect from MQTT broker."""
         self.client.loop_stop()
+        # Deliver already received sensor data before the connection goes away
+        self._stop_dispatch()
         self.client.disconnect()
         logger.info("MQTT client disconnected")
         
-    def register_sensor_callback(self, sensor_type: str, callback: Callable):
+    def register_sensor_callback(self, sensor_type: Union[SensorType, str], callback: Callable):
         """
         Register a callback for sensor data.
         
         Args:
-            sensor_type: Type of sensor (e.g., 'ph', 'ec', 'temperature', 'bme280')
-            callback: Callback function that takes (sensor_type, data) as arguments
+            sensor_type: SensorType or its name ('ph', 'ec', 'temperature', 'bme280')
+            callback: Callback function that takes (sensor_type, data) as arguments,
+                with sensor_type passed as its name
+                
+        Raises:
+            ValueError: If sensor_type is not a known sensor type
+        """
+        if isinstance(sensor_type, str):
+            idx = _NAME_TO_IDX.get(sensor_type)
+            if idx is None:
+                raise ValueError(f"Unknown sensor type: {sensor_type}")
+        else:
+            idx = SensorType(sensor_type)
+        # Copy-on-write so the dispatch thread can iterate without a lock
+        self._callbacks[idx] = self._callbacks[idx] + (callback,)
+        logger.debug(f"Registered callback for {SENSOR_NAMES[idx]} sensor")
+        
+    def register_connect_callback(self, callback: Callable):
+        """
+        Register a callback run (without arguments) on each successful connect.
+        
+        It runs on paho's network thread, so it should return quickly.
+        
+        Args:
+            callback: Callback function taking no arguments
         """
-        if sensor_type not in self.sensor_callbacks:
-            self.sensor_callbacks[sensor_type] = []
-        self.sensor_callbacks[sensor_type].append(callback)
-        logger.debug(f"Registered callback for {sensor_type} sensor")
+        self._connect_callbacks = self._connect_callbacks + (callback,)
         
-    def publish_command(self, actuator: str, command: str, duration_ms: Optional[int] = None):
+    def wait_for_actuator_state(self, timeout: float) -> bool:
+        """
+        Wait until the broker has delivered the retained actuator state after connecting.
+        
+        Args:
+            timeout: Maximum time to wait in seconds
+            
+        Returns:
+            True if the state was delivered, False on timeout
+        """
+        return self._actuator_state_ready.wait(timeout)
+        
+    def get_retained_command(self, actuator: str) -> Optional[str]:
+        """
+        Get the untimed command the broker retained for an actuator.
+        
+        Args:
+            actuator: Actuator name (e.g., 'lights', 'fans')
+            
+        Returns:
+            The retained command (e.g., 'ON'), or None if none was received
+        """
+        return self._retained_commands.get(actuator)
+        
+    def publish_command(self, actuator: str, command: str, duration_ms: Optional[int] = None) -> bool:
         """
         Publish command to actuator.
         
+        Untimed commands are published retained, so the broker holds each
+        actuator's state. Timed commands (doses) are never retained.
+        
         Args:
             actuator: Actuator name (e.g., 'ph_pump', 'nutrient_pump', 'lights', 'fans')
             command: Command to send (e.g., 'ON', 'OFF')
             duration_ms: Optional duration in milliseconds for timed commands
+            
+        Returns:
+            True if the command was sent, or (QoS > 0 only) queued by paho to
+            be sent after a reconnect; False if it was lost
         """
-        topic_map = {
-            'ph_pump': self.config.topic_ph_pump,
-            'nutrient_pump': self.config.topic_nutrient_pump,
-            'main_pump': self.config.topic_main_pump,
-            'lights': self.config.topic_lights,
-            'fans': self.config.topic_fans,
-        }
-        
-        if actuator not in topic_map:
+        topic = self._actuator_topics.get(actuator)
+        if topic is None:
             logger.error(f"Unknown actuator: {actuator}")
-            return
-            
-        topic = topic_map[actuator]
+            return False
         
         # Build payload
-        payload = {
-            'command': command,
-        }
-        if duration_ms is not None:
-            payload['duration_ms'] = duration_ms
+        payload_json = _COMMAND_PAYLOADS.get(command) if duration_ms is None else None
+        if payload_json is None:
+            payload = {
+                'command': command,
+            }
+            if duration_ms is not None:
+                payload['duration_ms'] = duration_ms
+            payload_json = orjson.dumps(payload)
             
         # Publish message
         try:
-            payload_json = json.dumps(payload)
-            result = self.client.publish(topic, payload_json, qos=1)
+            qos = self.config.actuator_qos.get(actuator, 0)
+            retain = duration_ms is None
+            result = self.client.publish(topic, payload_json, qos=qos, retain=retain)
             if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                logger.info(f"Published command to {actuator}: {payload_json}")
-            else:
-                logger.error(f"Failed to publish command to {actuator}")
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("Published command to %s: %s", actuator, payload_json.decode())
+                return True
+            if result.rc == mqtt.MQTT_ERR_NO_CONN and qos > 0:
+                # paho keeps QoS 1/2 messages and sends them once reconnected
+                logger.warning(f"Queued command to {actuator} until the broker reconnects")
+                return True
+            logger.error(f"Failed to publish command to {actuator}")
         except Exception as e:
             logger.error(f"Error publishing command: {e}")
+        return False
+            
+    def publish_commands(self, commands: List[Any]) -> List[bool]:
+        """
+        Publish each command in order.
+        
+        Args:
+            commands: Commands with action, command and an optional
+                duration_ms, as produced by the rule controller
+                
+        Returns:
+            publish_command()'s result for each command
+        """
+        return [self.publish_command(command.action, command.command, command.duration_ms)
+                for command in commands]
@@ -1,17 +1,91 @@
 """Rule-based control logic for PFAL automation."""
 import logging
+import time
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, NamedTuple, Optional
 
 from .config import ControlConfig
 
 
 logger = logging.getLogger(__name__)
 
+# Stand-in (value, timestamp) for a sensor without a reading
+_NO_READING = (None, None)
+
+class _LazyReason:
+    """A command reason that is only formatted when converted to str (i.e. logged)."""
+    __slots__ = ('fmt', 'args')
+    
+    def __init__(self, fmt: str, args: tuple):
+        self.fmt = fmt
+        self.args = args
+        
+    def __str__(self) -> str:
+        return self.fmt % self.args
+        
+    __repr__ = __str__
+
+
+class Command(NamedTuple):
+    """An actuator command produced by a rule."""
+    action: str
+    command: str
+    # Run time for timed actions (pump doses), None for plain on/off state
+    duration_ms: Optional[int] = None
+    # Why the rule fired; only ever logged (may be a lazily formatted object)
+    reason: Any = None
+
+
+class ThresholdRule(NamedTuple):
+    """A sensor threshold rule driving one actuator."""
+    sensor: str
+    action: str
+    label: str
+    unit: str
+    actuator_name: str
+    # ON when the value is below (dosing rules) / above (fan rules) these limits
+    on_below: Optional[float] = None
+    on_above: Optional[float] = None
+    duration_ms: Optional[int] = None
+    # Warn (without acting) when the value is above this limit
+    warn_above: Optional[float] = None
+    # Fan rules only (see evaluate_fan_control): OFF when the value is below
+    # this limit (inclusive if off_inclusive) and the other fan sensor, if
+    # it has a reading, is below interlock_max
+    off_below: Optional[float] = None
+    off_inclusive: bool = False
+    interlock_max: float = 0.0
+
 
 class RuleBasedController:
     """Implements IF-THEN rules for PFAL control."""
     
+    # Sensor-driven rules that read each signal. Temperature and humidity
+    # both feed the single fan rule.
+    DEP_MAP = {
+        'ph': ('evaluate_ph_control',),
+        'ec': ('evaluate_ec_control',),
+        'temperature': ('evaluate_fan_control',),
+        'humidity': ('evaluate_fan_control',),
+    }
+    
+    # Order in which sensor-driven rules are evaluated
+    SENSOR_RULES = (
+        'evaluate_ph_control',
+        'evaluate_ec_control',
+        'evaluate_fan_control',
+    )
+    
+    __slots__ = (
+        'config', 'last_sensor_readings', '_epsilon', '_max_interval',
+        '_last_lights_cmd',
+        # Derived in invalidate_thresholds()
+        '_ph_min', '_ph_max', '_ec_min', '_temp_on', '_temp_off', '_humidity_on', '_humidity_off',
+        '_ph_pump_duration_ms', '_nutrient_pump_duration_ms', '_eval_plans',
+        '_lights_on', '_lights_off', '_lights_commands', '_ph_rule', '_ec_rule',
+        '_temp_fan_rule', '_humidity_fan_rule', '_command_templates',
+    )
+    
     def __init__(self, config: ControlConfig):
         """
         Initialize rule-based controller.
@@ -20,476 +94,262 @@ class RuleBasedController:
             config: Control configuration with thresholds
         """
         self.config = config
+        # sensor_type -> (value, time.monotonic() when received)
         self.last_sensor_readings = {}
+        # Readings closer than epsilon to the stored one are coalesced,
+        # unless the stored reading is older than max_interval seconds
+        self._epsilon = {'ph': 0.02, 'ec': 0.02, 'temperature': 0.1, 'humidity': 0.5}
+        self._max_interval = 5.0
+        # Last lights state returned by the schedule rule
+        self._last_lights_cmd: Optional[str] = None
+        self.invalidate_thresholds()
         
-    def update_sensor_reading(self, sensor_type: str, value: Any):
+    def update_config(self, config: Optional[ControlConfig] = None):
         """
-        Update the latest sensor reading.
+        Apply a new (or mutated) control configuration.
+        
+        In the running service use PFALController.update_control_config(),
+        which also refreshes the values the controller derives from it.
         
         Args:
-            sensor_type: Type of sensor (e.g., 'ph', 'ec', 'temperature', 'humidity')
-            value: Sensor value
+            config: Replacement configuration; None re-reads the current one
         """
-        self.last_sensor_readings[sensor_type] = {
-            'value': value,
-            'timestamp': datetime.now()
-        }
-        logger.debug(f"Updated {sensor_type} reading: {value}")
+        if config is not None:
+            self.config = config
+        self.invalidate_thresholds()
+        
+    def invalidate_thresholds(self):
+        """Recompute the cached rule thresholds; call after mutating the config."""
+        config = self.config
+        self._ph_min = config.ph_target - config.ph_tolerance
+        self._ph_max = config.ph_target + config.ph_tolerance
+        self._ec_min = config.ec_target - config.ec_tolerance
+        self._temp_on = config.temp_max
+        self._temp_off = config.temp_max - 2.0  # 2°C hysteresis
+        self._humidity_on = config.humidity_max
+        self._humidity_off = config.humidity_max - 5.0  # 5% hysteresis
+        self._ph_pump_duration_ms = config.ph_pump_duration_ms
+        self._nutrient_pump_duration_ms = config.nutrient_pump_duration_ms
+        
+        # Rule evaluators to run per set of updated signals (see evaluate_for)
+        self._eval_plans: Dict[frozenset, tuple] = {}
+        
+        self._lights_on = config.lights_on_hour
+        self._lights_off = config.lights_off_hour
+        # Constant lighting commands (shared between calls), indexed by
+        # whether the hour is within the schedule
+        self._lights_commands = (
+            Command('lights', 'OFF', reason='Outside lighting schedule'),
+            Command('lights', 'ON',
+                    reason=f'Within lighting schedule ({self._lights_on}:00-{self._lights_off}:00)'),
+        )
         
-    def evaluate_ph_control(self) -> Optional[Dict[str, Any]]:
+        # Threshold rules; the temperature and humidity rules are the two
+        # halves of the fan rule, each interlocked with the other's maximum
+        self._ph_rule = ThresholdRule('ph', 'ph_pump', 'pH', '', 'pH pump',
+                                      on_below=self._ph_min, duration_ms=self._ph_pump_duration_ms,
+                                      warn_above=self._ph_max)
+        self._ec_rule = ThresholdRule('ec', 'nutrient_pump', 'EC', '', 'nutrient pump',
+                                      on_below=self._ec_min, duration_ms=self._nutrient_pump_duration_ms)
+        self._temp_fan_rule = ThresholdRule('temperature', 'fans', 'Temperature', '°C', 'fans',
+                                            on_above=self._temp_on,
+                                            off_below=self._temp_off, off_inclusive=True,
+                                            interlock_max=self._humidity_on)
+        self._humidity_fan_rule = ThresholdRule('humidity', 'fans', 'Humidity', '%', 'fans',
+                                                on_above=self._humidity_on,
+                                                off_below=self._humidity_off,
+                                                interlock_max=self._temp_on)
+        
+        # Shared commands for every rule outcome, keyed by (sensor, command)
+        self._command_templates = {}
+        for rule in (self._ph_rule, self._ec_rule, self._temp_fan_rule, self._humidity_fan_rule):
+            self._command_templates[rule.sensor, 'ON'] = Command(rule.action, 'ON', rule.duration_ms)
+            self._command_templates[rule.sensor, 'OFF'] = Command(rule.action, 'OFF')
+        
+    def update_sensor_reading(self, sensor_type: str, value: Any, ts: Optional[float] = None) -> bool:
         """
-        Evaluate pH control rules.
+        Update the latest sensor reading.
         
+        A reading equal to, or within the sensor's epsilon of, the stored one
+        is dropped while the stored reading is younger than the maximum
+        interval. Sensor types without an epsilon only drop exact repeats.
+        
+        Args:
+            sensor_type: Type of sensor (e.g., 'ph', 'ec', 'temperature', 'humidity')
+            value: Sensor value
+            ts: time.monotonic() at which the reading was received; lets a
+                caller share one clock read across several fields of a message
+            
         Returns:
-            Command dictionary if action needed, None otherwise
+            True if the reading was stored, False if it was coalesced
         """
-        if 'ph' not in self.last_sensor_readings:
-            return None
-            
-        ph_value = self.last_sensor_readings['ph']['value']
-        ph_min = self.config.ph_target - self.config.ph_tolerance
-        ph_max = self.config.ph_target + self.config.ph_tolerance
-        
-        # Rule: IF pH is too low, THEN activate pH up pump
-        if ph_value < ph_min:
-            logger.info(f"pH too low ({ph_value:.2f} < {ph_min:.2f}), activating pH pump")
-            return {
-                'action': 'ph_pump',
-                'command': 'ON',
-                'duration_ms': self.config.ph_pump_duration_ms,
-                'reason': f'pH {ph_value:.2f} below target range'
-            }
-        
-        # Rule: IF pH is too high, THEN log warning (pH down could be added)
-        elif ph_value > ph_max:
-            logger.warning(f"pH too high ({ph_value:.2f} > {ph_max:.2f})")
-            # Could add pH down pump control here
-            
-        return None
+        now = time.monotonic() if ts is None else ts
+        last = self.last_sensor_readings.get(sensor_type)
+        if (last is not None
+                and (value == last[0] or abs(value - last[0]) < self._epsilon.get(sensor_type, 0.0))
+                and now - last[1] < self._max_interval):
+            return False
+        self.last_sensor_readings[sensor_type] = (value, now)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Updated %s reading: %s", sensor_type, value)
+        return True
         
-    def evaluate_ec_control(self) -> Optional[Dict[str, Any]]:
+    def _eval_threshold(self, rule: ThresholdRule) -> Optional[Command]:
         """
-        Evaluate EC (nutrient) control rules.
+        Evaluate a dosing (pH or EC) threshold rule against its latest reading.
         
+        Args:
+            rule: Threshold rule to evaluate
+            
         Returns:
-            Command dictionary if action needed, None otherwise
+            Command if action needed, None otherwise
         """
-        if 'ec' not in self.last_sensor_readings:
+        readings = self.last_sensor_readings
+        value = readings.get(rule.sensor, _NO_READING)[0]
+        if value is None:
             return None
-            
-        ec_value = self.last_sensor_readings['ec']['value']
-        ec_min = self.config.ec_target - self.config.ec_tolerance
-        
-        # Rule: IF EC is too low, THEN activate nutrient pump
-        if ec_value < ec_min:
-            logger.info(f"EC too low ({ec_value:.2f} < {ec_min:.2f}), activating nutrient pump")
-            return {
-                'action': 'nutrient_pump',
-                'command': 'ON',
-                'duration_ms': self.config.nutrient_pump_duration_ms,
-                'reason': f'EC {ec_value:.2f} below target range'
-            }
+        
+        # Rule: IF value is too low, THEN activate the actuator
+        if rule.on_below is not None and value < rule.on_below:
+            logger.info("%s too low (%.2f%s < %.2f%s), activating %s",
+                        rule.label, value, rule.unit, rule.on_below, rule.unit, rule.actuator_name)
+            return self._command(rule, 'ON', '%s %.2f%s below target range', rule.label, value, rule.unit)
+        
+        # Rule: IF value is too high but nothing can correct it, THEN log warning
+        if rule.warn_above is not None and value > rule.warn_above:
+            logger.warning("%s too high (%.2f%s > %.2f%s)",
+                           rule.label, value, rule.unit, rule.warn_above, rule.unit)
             
         return None
         
-    def evaluate_temperature_control(self) -> Optional[Dict[str, Any]]:
+    def _command(self, rule: ThresholdRule, command: str, reason: str, *args: Any) -> Command:
         """
-        Evaluate temperature control rules.
+        Get the command for a fired threshold rule.
         
+        The reason is only ever logged: it is attached as a _LazyReason when
+        INFO logging is enabled, and otherwise the shared template is returned.
+        
+        Args:
+            rule: Threshold rule that fired
+            command: Command to send ('ON' or 'OFF')
+            reason: %-style format string for the reason
+            args: Arguments for the reason format string
+            
         Returns:
-            Command dictionary if action needed, None otherwise
+            Command with action, command, optional duration_ms and (when
+            INFO is enabled) reason
         """
-        if 'temperature' not in self.last_sensor_readings:
-            return None
-            
-        temp_value = self.last_sensor_readings['temperature']['value']
-        
-        # Rule: IF temperature is too high, THEN activate fans
-        if temp_value > self.config.temp_max:
-            logger.info(f"Temperature too high ({temp_value:.2f}°C > {self.config.temp_max:.2f}°C), activating fans")
-            return {
-                'action': 'fans',
-                'command': 'ON',
-                'reason': f'Temperature {temp_value:.2f}°C above maximum'
-            }
-        
-        # Rule: IF temperature is in range, THEN turn off fans (if not needed for humidity)
-        elif temp_value <= self.config.temp_max - 2.0:  # 2°C hysteresis
-            # Only turn off if humidity is also okay
-            if 'humidity' not in self.last_sensor_readings or self.last_sensor_readings['humidity']['value'] < self.config.humidity_max:
-                return {
-                    'action': 'fans',
-                    'command': 'OFF',
-                    'reason': f'Temperature {temp_value:.2f}°C in normal range'
-                }
-            
-        return None
-
-    def evaluate_humidity_control(self) -> Optional[Dict[str, Any]]:
+        template = self._command_templates[rule.sensor, command]
+        if not logger.isEnabledFor(logging.INFO):
+            return template
+        return template._replace(reason=_LazyReason(reason, args))
+        
+    def evaluate_ph_control(self) -> Optional[Command]:
         """
-        Evaluate humidity control rules.
-
+        Evaluate pH control rules.
+        
         Returns:
-            Command dictionary if action needed, None otherwise
+            Command if action needed, None otherwise
         """
-        if 'humidity' not in self.last_sensor_readings:
-            return None
-
-        humidity_value = self.last_sensor_readings['humidity']['value']
-
-        # Rule: IF humidity is too high, THEN activate fans
-        if humidity_value > self.config.humidity_max:
-            logger.info(f"Humidity too high ({humidity_value:.2f}% > {self.config.humidity_max:.2f}%), activating fans")
-            return {
-                'action': 'fans',
-                'command': 'ON',
-                'reason': f'Humidity {humidity_value:.2f}% above maximum'
-            }
-        
-        # Rule: IF humidity is in range, THEN turn off fans (if not needed for temp)
-        elif humidity_value < self.config.humidity_max - 5.0: # 5% hysteresis
-            if 'temperature' not in self.last_sensor_readings or self.last_sensor_readings['temperature']['value'] < self.config.temp_max:
-                return {
-                    'action': 'fans',
-                    'command': 'OFF',
-                    'reason': f'Humidity {humidity_value:.2f}% in normal range'
-                }
-
-        return None
+        return self._eval_threshold(self._ph_rule)
         
-    def evaluate_lighting_schedule(self) -> Optional[Dict[str, Any]]:
+    def evaluate_ec_control(self) -> Optional[Command]:
         """
-        Evaluate lighting schedule rules.
+        Evaluate EC (nutrient) control rules.
         
         Returns:
-            Command dictionary if action needed, None otherwise
+            Command if action needed, None otherwise
         """
-        current_hour = datetime.now().hour
+        return self._eval_threshold(self._ec_rule)
         
-        # Rule: IF current time is within lighting hours, THEN lights ON
-        if self.config.lights_on_hour <= current_hour < self.config.lights_off_hour:
-            return {
-                'action': 'lights',
-                'command': 'ON',
-                'reason': f'Within lighting schedule ({self.config.lights_on_hour}:00-{self.config.lights_off_hour}:00)'
-            }
-        # Rule: ELSE lights OFF
-        else:
-            return {
-                'action': 'lights',
-                'command': 'OFF',
-                'reason': f'Outside lighting schedule'
-            }
-            
-    def evaluate_all_rules(self) -> list:
+    def evaluate_fan_control(self) -> Optional[Command]:
         """
-        Evaluate all control rules.
+        Evaluate the temperature and humidity fan rules as one fan command.
+        
+        The fans are ON if either reading is above its maximum. Otherwise
+        they are turned OFF once a reading is back in its normal range,
+        unless the other reading still needs ventilation.
         
         Returns:
-            List of command dictionaries for actions that need to be taken
+            Command if action needed, None otherwise
         """
-        commands = []
+        readings = self.last_sensor_readings
+        temp = readings.get('temperature', _NO_READING)[0]
+        humidity = readings.get('humidity', _NO_READING)[0]
+        checks = ((self._temp_fan_rule, temp, humidity), (self._humidity_fan_rule, humidity, temp))
         
-        # The order can matter. Temp/Humidity might both want to control fans.
-        # A simple approach is to collect all desired commands and merge them.
-        # A more complex one would prioritize. For now, let's just collect.
+        # Rule: IF temperature or humidity is too high, THEN fans ON
+        for rule, value, _ in checks:
+            if value is not None and value > rule.on_above:
+                logger.info("%s too high (%.2f%s > %.2f%s), activating %s",
+                            rule.label, value, rule.unit, rule.on_above, rule.unit, rule.actuator_name)
+                return self._command(rule, 'ON', '%s %.2f%s above maximum', rule.label, value, rule.unit)
         
-        ph_command = self.evaluate_ph_control()
-        if ph_command:
-            commands.append(ph_command)
-            
-        ec_command = self.evaluate_ec_control()
-        if ec_command:
-            commands.append(ec_command)
-            
-        temp_command = self.evaluate_temperature_control()
-        if temp_command:
-            commands.append(temp_command)
-
-        humidity_command = self.evaluate_humidity_control()
-        if humidity_command:
-            commands.append(humidity_command)
-            
-        light_command = self.evaluate_lighting_schedule()
-        if light_command:
-            commands.append(light_command)
+        # Rule: IF a value is back in range and the other one does not need the fans, THEN fans OFF
+        for rule, value, other in checks:
+            if (value is not None
+                    and (value <= rule.off_below if rule.off_inclusive else value < rule.off_below)
+                    and (other is None or other < rule.interlock_max)):
+                return self._command(rule, 'OFF', '%s %.2f%s in normal range', rule.label, value, rule.unit)
             
-        return commands
-
-"""```
-
-2.  **Update `src/pfal_controller/controller.py`** to handle humidity data.
-
-```python name=src/pfal_controller/controller.py """
-"""Main PFAL controller that orchestrates all components."""
-import logging
-import signal
-import sys
-import time
-from typing import Dict, Any
-
-from .config import load_config
-from .mqtt_client import MQTTClient
-from .influxdb_persistence import InfluxDBPersistence
-from .rule_controller import RuleBasedController
-
-
-logger = logging.getLogger(__name__)
-
-
-class PFALController:
-    """Main controller for PFAL automation system."""
-    
-    def __init__(self, config_file: str = None):
-        """
-        Initialize PFAL controller.
+        return None
         
-        Args:
-            config_file: Path to configuration file (optional)
+    def evaluate_lighting_schedule(self) -> Optional[Command]:
         """
-        # Load configuration
-        self.config = load_config(config_file)
+        Evaluate lighting schedule rules.
         
-        # Initialize components
-        self.mqtt_client = MQTTClient(self.config.mqtt)
-        self.influxdb = InfluxDBPersistence(self.config.influxdb)
-        self.rule_controller = RuleBasedController(self.config.control)
+        The rule is edge-triggered: a command is only returned when the
+        scheduled state differs from the one returned previously.
         
-        # Track last light state to avoid redundant commands
-        self.last_light_state = None
-        self.last_fan_state = None
+        Returns:
+            Command if action needed, None otherwise
+        """
+        current_hour = datetime.now().hour
         
-        self.running = False
+        # Rule: IF current time is within lighting hours, THEN lights ON, ELSE lights OFF
+        command = self._lights_commands[self._lights_on <= current_hour < self._lights_off]
+        if command.command == self._last_lights_cmd:
+            return None
+        self._last_lights_cmd = command.command
+        return command
         
-    def _handle_sensor_data(self, sensor_type: str, data: Dict[str, Any]):
+    def reset_lighting_schedule(self):
+        """Forget the last lights state, so the next schedule evaluation returns a command."""
+        self._last_lights_cmd = None
+            
+    def evaluate_for(self, *signals: str) -> list:
         """
-        Handle incoming sensor data.
+        Evaluate only the rules whose inputs depend on the given signals.
         
         Args:
-            sensor_type: Type of sensor
-            data: Sensor data dictionary
-        """
-        try:
-            # Parse sensor data and persist to InfluxDB
-            if sensor_type == 'ph':
-                value = data.get('value')
-                if value is not None:
-                    sensor_id = data.get('sensor_id', 'default')
-                    self.influxdb.write_ph_reading(float(value), sensor_id)
-                    self.rule_controller.update_sensor_reading('ph', float(value))
-                    
-            elif sensor_type == 'ec':
-                value = data.get('value')
-                if value is not None:
-                    sensor_id = data.get('sensor_id', 'default')
-                    self.influxdb.write_ec_reading(float(value), sensor_id)
-                    self.rule_controller.update_sensor_reading('ec', float(value))
-                    
-            elif sensor_type == 'temperature':
-                value = data.get('value')
-                if value is not None:
-                    sensor_id = data.get('sensor_id', 'default')
-                    self.influxdb.write_temperature_reading(float(value), sensor_id)
-                    self.rule_controller.update_sensor_reading('temperature', float(value))
-                    
-            elif sensor_type == 'bme280':
-                temperature = data.get('temperature')
-                humidity = data.get('humidity')
-                pressure = data.get('pressure')
-                if all([temperature is not None, humidity is not None, pressure is not None]):
-                    sensor_id = data.get('sensor_id', 'default')
-                    self.influxdb.write_bme280_reading(
-                        float(temperature),
-                        float(humidity),
-                        float(pressure),
-                        sensor_id
-                    )
-                    # Also update temperature and humidity for control decisions
-                    self.rule_controller.update_sensor_reading('temperature', float(temperature))
-                    self.rule_controller.update_sensor_reading('humidity', float(humidity))
-                    
-            # Evaluate control rules after each sensor update
-            self._evaluate_and_execute_rules()
-            
-        except Exception as e:
-            logger.error(f"Error handling sensor data for {sensor_type}: {e}")
-            
-    def _evaluate_and_execute_rules(self):
-        """Evaluate control rules and execute necessary actions."""
-        try:
-            commands = self.rule_controller.evaluate_all_rules()
-            
-            # Simple conflict resolution: if any rule wants fans ON, they are ON.
-            fan_on_requested = any(cmd.get('action') == 'fans' and cmd.get('command') == 'ON' for cmd in commands)
-            
-            final_commands = []
-            fan_command_processed = False
-            for command in commands:
-                action = command.get('action')
-                
-                if action == 'fans':
-                    if not fan_command_processed:
-                        # Add a single, resolved fan command
-                        fan_cmd = 'ON' if fan_on_requested else 'OFF'
-                        final_commands.append({'action': 'fans', 'command': fan_cmd, 'reason': 'Resolved from temp/humidity rules'})
-                        fan_command_processed = True
-                else:
-                    # Add non-fan commands directly
-                    final_commands.append(command)
-
-
-            for command in final_commands:
-                action = command.get('action')
-                cmd = command.get('command')
-                duration_ms = command.get('duration_ms')
-                reason = command.get('reason')
-                
-                # Avoid redundant light commands
-                if action == 'lights':
-                    if self.last_light_state == cmd:
-                        continue
-                    self.last_light_state = cmd
-                    
-                # Avoid redundant fan commands
-                if action == 'fans':
-                    if self.last_fan_state == cmd:
-                        continue
-                    self.last_fan_state = cmd
-                
-                logger.info(f"Executing action: {action} -> {cmd} (Reason: {reason})")
-                self.mqtt_client.publish_command(action, cmd, duration_ms)
-                
-        except Exception as e:
-            logger.error(f"Error evaluating rules: {e}")
+            signals: Updated sensor types (e.g., 'ph', 'temperature')
             
-    def _periodic_schedule_check(self):
-        """Periodically check schedule-based rules (like lighting)."""
-        while self.running:
-            try:
-                # Check lighting schedule
-                light_command = self.rule_controller.evaluate_lighting_schedule()
-                if light_command:
-                    action = light_command.get('action')
-                    cmd = light_command.get('command')
-                    
-                    # Only send if state changed
-                    if self.last_light_state != cmd:
-                        reason = light_command.get('reason')
-                        logger.info(f"Executing scheduled action: {action} -> {cmd} (Reason: {reason})")
-                        self.mqtt_client.publish_command(action, cmd)
-                        self.last_light_state = cmd
-                        
-            except Exception as e:
-                logger.error(f"Error in periodic schedule check: {e}")
-                
-            # Check schedule every 60 seconds
-            time.sleep(60)
+        Returns:
+            List of commands for actions that need to be taken
+        """
+        key = frozenset(signals)
+        plan = self._eval_plans.get(key)
+        if plan is None:
+            names = set()
+            for signal in signals:
+                names.update(self.DEP_MAP.get(signal, ()))
+            plan = self._eval_plans[key] = tuple(
+                getattr(self, name) for name in self.SENSOR_RULES if name in names
+            )
             
-    def start(self):
-        """Start the PFAL controller."""
-        logger.info(f"Starting PFAL Controller with profile: {self.config.control.profile_name}")
+        return [command for command in (evaluate() for evaluate in plan) if command]
         
-        try:
-            # Connect to InfluxDB
-            self.influxdb.connect()
-            
-            # Connect to MQTT broker
-            self.mqtt_client.connect()
-            
-            # Register sensor callbacks
-            self.mqtt_client.register_sensor_callback('ph', self._handle_sensor_data)
-            self.mqtt_client.register_sensor_callback('ec', self._handle_sensor_data)
-            self.mqtt_client.register_sensor_callback('temperature', self._handle_sensor_data)
-            self.mqtt_client.register_sensor_callback('bme280', self._handle_sensor_data)
-            
-            self.running = True
-            
-            logger.info("PFAL Controller started successfully")
-            
-            # Start periodic checks in a separate thread to not block the main loop
-            import threading
-            schedule_thread = threading.Thread(target=self._periodic_schedule_check, daemon=True)
-            schedule_thread.start()
-            
-            # Keep the main thread alive to handle MQTT messages
-            while self.running:
-                time.sleep(1)
-            
-        except Exception as e:
-            logger.error(f"Failed to start PFAL Controller: {e}")
-            self.stop()
-            raise
-            
-    def stop(self):
-        """Stop the PFAL controller."""
-        if not self.running:
-            return
-            
-        logger.info("Stopping PFAL Controller...")
+    def evaluate_all_rules(self) -> list:
+        """
+        Evaluate all control rules.
         
-        self.running = False
+        Returns:
+            List of commands for actions that need to be taken
+        """
+        commands = self.evaluate_for(*self.DEP_MAP)
         
-        # Disconnect MQTT
-        try:
-            self.mqtt_client.disconnect()
-        except Exception as e:
-            logger.error(f"Error disconnecting MQTT client: {e}")
-            
-        # Disconnect InfluxDB
-        try:
-            self.influxdb.disconnect()
-        except Exception as e:
-            logger.error(f"Error disconnecting InfluxDB: {e}")
+        light_command = self.evaluate_lighting_schedule()
+        if light_command:
+            commands.append(light_command)
             
-        logger.info("PFAL Controller stopped")
-        
-
-def setup_logging(log_level=logging.INFO):
-    """Set up logging configuration."""
-    logging.basicConfig(
-        level=log_level,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        stream=sys.stdout # Log to stdout by default
-    )
-    # File handler can be added here if needed, but consider permissions
-    # handlers=[
-    #     logging.StreamHandler(sys.stdout),
-    #     logging.FileHandler('/var/log/pfal_controller.log', mode='a')
-    # ]
-
-
-def signal_handler(controller: PFALController):
-    def handler(signum, frame):
-        """Handle shutdown signals."""
-        logger.info(f"Received signal {signum}, shutting down...")
-        controller.stop()
-        sys.exit(0)
-    return handler
-
-
-def main():
-    """Main entry point for PFAL controller."""
-    # Set up logging
-    setup_logging()
-    
-    # Create controller instance
-    config_file = os.getenv('CONFIG_FILE')
-    controller = PFALController(config_file=config_file)
-    
-    # Set up signal handlers for graceful shutdown
-    shutdown_handler = signal_handler(controller)
-    signal.signal(signal.SIGINT, shutdown_handler)
-    signal.signal(signal.SIGTERM, shutdown_handler)
-    
-    try:
-        controller.start()
-    except KeyboardInterrupt:
-        logger.info("Received keyboard interrupt")
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}", exc_info=True)
-    finally:
-        controller.stop()
-
-
-if __name__ == '__main__':
-    main()
\ No newline at end of file
+        return commands
@@ -0,0 +1,35 @@
+import pytest
+from pfal_controller.config import load_config
+
+# --- Wire Format Tests ---
+
+@pytest.mark.parametrize("wire_format", ['bin', 'msgpack', ''])
+def test_unknown_wire_format_is_rejected(monkeypatch, wire_format):
+    """
+    GIVEN a WIRE_FORMAT that is neither json nor binary
+    WHEN the configuration is loaded
+    THEN a ValueError naming the setting should be raised.
+    """
+    # Arrange
+    monkeypatch.setenv('WIRE_FORMAT', wire_format)
+
+    # Act / Assert
+    with pytest.raises(ValueError, match='WIRE_FORMAT'):
+        load_config()
+
+@pytest.mark.parametrize("wire_format, expected", [('binary', 'binary'), ('JSON', 'json')])
+def test_supported_wire_format_is_loaded(monkeypatch, wire_format, expected):
+    """
+    GIVEN a supported WIRE_FORMAT, in any case
+    WHEN the configuration is loaded
+    THEN the MQTT config should carry it in lower case.
+    """
+    # Arrange
+    monkeypatch.setenv('WIRE_FORMAT', wire_format)
+    monkeypatch.setenv('CROP_PROFILE', 'spinach')
+
+    # Act
+    config = load_config()
+
+    # Assert
+    assert config.mqtt.wire_format == expected
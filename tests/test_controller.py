@@ -0,0 +1,323 @@
+import dataclasses
+from unittest import mock
+
+import pytest
+from pfal_controller.config import Config, ControlConfig
+from pfal_controller.controller import PFALController
+
+# A fixture to create a controller with mocked MQTT and InfluxDB clients
+@pytest.fixture
+def controller(monkeypatch):
+    """Returns a PFALController wired to MagicMock clients and a test profile."""
+    control = ControlConfig(
+        profile_name="test_profile",
+        ph_target=6.0,
+        ph_tolerance=0.3,
+        ec_target=1.5,
+        ec_tolerance=0.2,
+        temp_min=20.0,
+        temp_max=28.0,
+        humidity_min=50.0,
+        humidity_max=70.0,
+        lights_on_hour=6,
+        lights_off_hour=22,
+        ph_pump_duration_ms=1000,
+        nutrient_pump_duration_ms=2000,
+    )
+    monkeypatch.setattr('pfal_controller.controller.load_config',
+                        lambda config_file=None: Config(mqtt=None, influxdb=None, control=control))
+    monkeypatch.setattr('pfal_controller.controller.MQTTClient', mock.MagicMock())
+    monkeypatch.setattr('pfal_controller.controller.InfluxDBPersistence', mock.MagicMock())
+    controller = PFALController()
+    controller.mqtt_client.get_retained_command.return_value = None
+    controller.mqtt_client.publish_command.return_value = True
+    controller.mqtt_client.publish_commands.side_effect = lambda commands: [True] * len(commands)
+    return controller
+
+class MockDateTime:
+    """Stand-in for the rule controller's datetime with a settable hour."""
+    def __init__(self, hour):
+        self.hour = hour
+    def now(self):
+        return self
+
+# --- Shutdown Tests ---
+
+def test_restarted_controller_registers_one_exit_hook(controller, monkeypatch):
+    """
+    GIVEN a controller that is started, stopped and started again
+    WHEN start() registers its exit hook
+    THEN stop() should only be registered with atexit once.
+    """
+    # Arrange
+    register = mock.MagicMock()
+    monkeypatch.setattr('pfal_controller.controller.atexit.register', register)
+    monkeypatch.setattr(controller, '_periodic_schedule_check', lambda: None)
+
+    # Act
+    controller.start()
+    controller.stop()
+    controller.start()
+
+    # Assert
+    register.assert_called_once_with(controller.stop)
+
+def test_readings_drained_during_stop_are_not_acted_on(controller):
+    """
+    GIVEN a controller whose fans were turned OFF by a temperature reading
+    WHEN stop() drains further readings from the MQTT dispatch queue
+    THEN the readings should be persisted but no command published and no
+    debounced evaluation left pending.
+    """
+    # Arrange
+    controller._handle_sensor_data('temperature', {'value': 25.0})
+    publish = controller.mqtt_client.publish_commands
+    assert publish.call_count == 1
+
+    def drain():
+        controller._handle_sensor_data('temperature', {'value': 25.5})  # Debounced
+        controller._handle_sensor_data('temperature', {'value': 29.5})  # Urgent
+    controller.mqtt_client.disconnect.side_effect = drain
+
+    # Act
+    controller.stop()
+
+    # Assert
+    assert publish.call_count == 1
+    assert controller._eval_timer is None
+    assert controller.influxdb.write_temperature_reading.call_count == 3
+
+# --- Redundant Command Tests ---
+
+def test_first_command_to_each_actuator_is_sent(controller):
+    """
+    GIVEN a controller that has not commanded any actuator yet
+    WHEN the lights are commanded ON twice and the fans OFF
+    THEN the first ON and the first OFF should be sent and the repeated ON skipped.
+    """
+    # Act
+    first_on = controller._is_redundant('lights', 'ON')
+    controller._record_command('lights', 'ON')
+    repeated_on = controller._is_redundant('lights', 'ON')
+    first_off = controller._is_redundant('fans', 'OFF')
+
+    # Assert
+    assert first_on is False
+    assert repeated_on is True
+    assert first_off is False
+
+def test_state_change_after_repeat_is_sent(controller):
+    """
+    GIVEN fans that were commanded ON
+    WHEN they are commanded OFF and then OFF again
+    THEN the OFF should be sent and only the repeated OFF skipped.
+    """
+    # Arrange
+    controller._record_command('fans', 'ON')
+
+    # Act
+    off = controller._is_redundant('fans', 'OFF')
+    controller._record_command('fans', 'OFF')
+    repeated_off = controller._is_redundant('fans', 'OFF')
+
+    # Assert
+    assert off is False
+    assert repeated_off is True
+
+@pytest.mark.parametrize("action, duration_ms", [
+    ('ph_pump', 1000),     # Timed dose
+    ('sprinkler', None),   # Unknown actuator
+])
+def test_timed_and_unknown_commands_are_never_redundant(controller, action, duration_ms):
+    """
+    GIVEN a timed pump dose, or a command to an actuator without a state bit
+    WHEN the same command is checked twice
+    THEN neither check should report it as redundant.
+    """
+    # Act
+    first = controller._is_redundant(action, 'ON', duration_ms)
+    controller._record_command(action, 'ON', duration_ms)
+    second = controller._is_redundant(action, 'ON', duration_ms)
+
+    # Assert
+    assert first is False
+    assert second is False
+
+def test_first_command_matching_retained_state_is_redundant(controller):
+    """
+    GIVEN fans ON retained on the broker
+    WHEN the controller first commands the fans ON, then OFF
+    THEN the ON should be skipped as the broker state and the OFF sent.
+    """
+    # Arrange
+    controller.mqtt_client.get_retained_command.side_effect = {'fans': 'ON'}.get
+
+    # Act
+    on_redundant = controller._is_redundant('fans', 'ON')
+    off_redundant = controller._is_redundant('fans', 'OFF')
+
+    # Assert
+    assert on_redundant is True
+    assert off_redundant is False
+
+def test_first_lights_command_waits_for_retained_state(controller, monkeypatch):
+    """
+    GIVEN lights ON retained on the broker, delivered only after subscribing
+    WHEN the controller starts and runs its first schedule check
+    THEN it should wait for the retained state and skip the lights ON.
+    """
+    # Arrange
+    monkeypatch.setattr('pfal_controller.rule_controller.datetime', MockDateTime(12))
+    monkeypatch.setattr('pfal_controller.controller.atexit.register', mock.MagicMock())
+    monkeypatch.setattr(controller, '_seconds_until_next_light_switch', lambda now: controller.stop() or 0.0)
+    retained = {}
+
+    def deliver_retained_state(timeout):
+        retained['lights'] = 'ON'
+        return True
+    controller.mqtt_client.wait_for_actuator_state.side_effect = deliver_retained_state
+    controller.mqtt_client.get_retained_command.side_effect = retained.get
+
+    # Act
+    controller.start()
+
+    # Assert
+    controller.mqtt_client.publish_command.assert_not_called()
+
+def test_command_lost_to_a_failed_publish_is_sent_again(controller):
+    """
+    GIVEN a fans ON command whose publish failed
+    WHEN temperature readings keep asking for the fans
+    THEN fans ON should be sent again, and skipped only once it was published.
+    """
+    # Arrange
+    publish = controller.mqtt_client.publish_commands
+    publish.side_effect = lambda commands: [False] * len(commands)
+    controller._handle_sensor_data('temperature', {'value': 29.5})
+    publish.side_effect = lambda commands: [True] * len(commands)
+
+    # Act
+    controller._handle_sensor_data('temperature', {'value': 32.0})
+    controller._handle_sensor_data('temperature', {'value': 34.5})
+
+    # Assert
+    assert publish.call_count == 2
+    resent = publish.call_args.args[0]
+    assert [(command.action, command.command) for command in resent] == [('fans', 'ON')]
+
+def test_lights_command_lost_to_a_failed_publish_is_sent_again(controller, monkeypatch):
+    """
+    GIVEN a schedule check whose lights ON publish fails
+    WHEN the schedule is checked twice more
+    THEN lights ON should be sent once more, and not again after it was published.
+    """
+    # Arrange
+    monkeypatch.setattr('pfal_controller.rule_controller.datetime', MockDateTime(12))
+    publish = controller.mqtt_client.publish_command
+    publish.side_effect = [False, True]
+    checks = []
+
+    def seconds_until_switch(now):
+        checks.append(now)
+        if len(checks) == 3:
+            controller.stop()
+        return 0.0
+    monkeypatch.setattr(controller, '_seconds_until_next_light_switch', seconds_until_switch)
+
+    # Act
+    controller._periodic_schedule_check()
+
+    # Assert
+    assert publish.call_args_list == [mock.call('lights', 'ON'), mock.call('lights', 'ON')]
+
+def test_reconnect_forgets_recorded_actuator_state(controller, monkeypatch):
+    """
+    GIVEN fans and lights that were commanded ON
+    WHEN the MQTT client reconnects
+    THEN the next commands to them should be sent again and the schedule re-checked.
+    """
+    # Arrange
+    monkeypatch.setattr('pfal_controller.rule_controller.datetime', MockDateTime(12))
+    controller._record_command('fans', 'ON')
+    controller.rule_controller.evaluate_lighting_schedule()
+    controller._record_command('lights', 'ON')
+
+    # Act
+    controller._handle_connect()
+
+    # Assert
+    assert controller._is_redundant('fans', 'ON') is False
+    assert controller._is_redundant('lights', 'ON') is False
+    assert controller.rule_controller.evaluate_lighting_schedule().command == 'ON'
+    assert controller._schedule_wakeup.is_set()
+
+# --- Debounced Evaluation Tests ---
+
+def test_small_change_is_evaluated_after_the_debounce(controller):
+    """
+    GIVEN a low pH reading that was dosed for right away
+    WHEN a slightly different low reading arrives
+    THEN rules should only run once the debounce timer fires.
+    """
+    # Arrange
+    controller._handle_sensor_data('ph', {'value': 5.5})
+    publish = controller.mqtt_client.publish_commands
+    assert publish.call_count == 1
+
+    # Act
+    controller._handle_sensor_data('ph', {'value': 5.6})
+    pending_timer = controller._eval_timer
+    published_before_timer = publish.call_count
+    pending_timer.cancel()
+    controller._maybe_evaluate()
+
+    # Assert
+    assert pending_timer is not None
+    assert published_before_timer == 1
+    assert publish.call_count == 2
+    assert controller._eval_timer is None
+
+def test_large_jump_is_evaluated_immediately_with_pending_signals(controller):
+    """
+    GIVEN a debounced pH change waiting for the timer
+    WHEN temperature jumps by more than its hysteresis band
+    THEN rules should run right away for both signals and the timer find nothing left.
+    """
+    # Arrange
+    controller._handle_sensor_data('ph', {'value': 5.5})
+    controller._handle_sensor_data('temperature', {'value': 25.0})
+    controller._handle_sensor_data('ph', {'value': 5.6})
+    publish = controller.mqtt_client.publish_commands
+    publish.reset_mock()
+
+    # Act
+    controller._handle_sensor_data('temperature', {'value': 29.5})
+    controller._eval_timer.cancel()
+    controller._maybe_evaluate()
+
+    # Assert
+    publish.assert_called_once()
+    commands = publish.call_args.args[0]
+    assert [(command.action, command.command) for command in commands] == [('ph_pump', 'ON'), ('fans', 'ON')]
+
+def test_control_config_update_refreshes_immediate_eval_deltas(controller):
+    """
+    GIVEN a controller whose pH tolerance is widened at runtime
+    WHEN a low pH reading is followed by a change within the new tolerance
+    THEN the dose should use the new duration and the change wait for the debounce.
+    """
+    # Arrange
+    controller.update_control_config(dataclasses.replace(controller.config.control, ph_tolerance=1.0,
+                                                         ph_pump_duration_ms=2500))
+    publish = controller.mqtt_client.publish_commands
+
+    # Act
+    controller._handle_sensor_data('ph', {'value': 4.0})
+    controller._handle_sensor_data('ph', {'value': 4.5})
+    pending_timer = controller._eval_timer
+    pending_timer.cancel()
+
+    # Assert
+    publish.assert_called_once()
+    assert publish.call_args.args[0][0].duration_ms == 2500
+    assert pending_timer is not None
@@ -0,0 +1,84 @@
+from unittest import mock
+
+import pytest
+from influxdb_client import Point, WritePrecision
+from pfal_controller.config import InfluxDBConfig
+from pfal_controller.influxdb_persistence import InfluxDBPersistence
+
+TIMESTAMP = 1700000000
+
+# A fixture to create a persistence layer with a mocked write API
+@pytest.fixture
+def persistence(monkeypatch):
+    """Returns an InfluxDBPersistence whose write API is a MagicMock and whose clock is fixed."""
+    monkeypatch.setattr('pfal_controller.influxdb_persistence.time.time', lambda: TIMESTAMP)
+    persistence = InfluxDBPersistence(InfluxDBConfig(url='http://localhost:8086', token='', org='pfal',
+                                                     bucket='pfal_sensors'))
+    persistence.write_api = mock.MagicMock()
+    return persistence
+
+def written_lines(persistence):
+    """Return the records handed to the write API as line protocol."""
+    records = [call.kwargs['record'] for call in persistence.write_api.write.call_args_list]
+    return [record if isinstance(record, str) else record.to_line_protocol() for record in records]
+
+SENSOR_IDS = ['esp32_1', 'zone a', 'a,b=c', 'tab\there', 'cr\rlf\n', 'ends\\']
+
+# --- Line Protocol Tests ---
+
+@pytest.mark.parametrize("sensor_id", SENSOR_IDS)
+@pytest.mark.parametrize("value", [6.5, 6.0, 0.1 + 0.2, 1e-07])
+def test_value_reading_matches_point_line_protocol(persistence, sensor_id, value):
+    """
+    GIVEN a single-value sensor reading
+    WHEN it is written through the line protocol template
+    THEN the line should equal the one Point produces for the same reading.
+    """
+    # Arrange
+    expected = Point('ph').tag('sensor_id', sensor_id).field('value', value) \
+        .time(TIMESTAMP, WritePrecision.S).to_line_protocol()
+
+    # Act
+    persistence.write_ph_reading(value, sensor_id)
+
+    # Assert
+    assert written_lines(persistence) == [expected]
+
+@pytest.mark.parametrize("sensor_id", SENSOR_IDS)
+def test_bme280_reading_matches_point_line_protocol(persistence, sensor_id):
+    """
+    GIVEN a BME280 reading with temperature, humidity and pressure
+    WHEN it is written through the line protocol template
+    THEN the line should equal the one Point produces for the same reading.
+    """
+    # Arrange
+    expected = Point('bme280').tag('sensor_id', sensor_id) \
+        .field('temperature', 24.5).field('humidity', 61.0).field('pressure', 1013.25) \
+        .time(TIMESTAMP, WritePrecision.S).to_line_protocol()
+
+    # Act
+    persistence.write_bme280_reading(24.5, 61.0, 1013.25, sensor_id)
+
+    # Assert
+    assert written_lines(persistence) == [expected]
+
+@pytest.mark.parametrize("value, sensor_id", [
+    (7, 'esp32_1'),              # Integer field
+    (float('nan'), 'esp32_1'),   # Dropped field
+    (6.5, ''),                   # Empty tag
+])
+def test_readings_the_template_cannot_encode_fall_back_to_point(persistence, value, sensor_id):
+    """
+    GIVEN a reading with an integer or non-finite value, or an empty sensor_id
+    WHEN it is written
+    THEN the output should be the same as writing it as a Point.
+    """
+    # Arrange
+    expected = Point('ec').tag('sensor_id', sensor_id).field('value', value) \
+        .time(TIMESTAMP, WritePrecision.S).to_line_protocol()
+
+    # Act
+    persistence.write_ec_reading(value, sensor_id)
+
+    # Assert
+    assert written_lines(persistence) == [expected]
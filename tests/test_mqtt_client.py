@@ -0,0 +1,218 @@
+import importlib.util
+import os
+from types import SimpleNamespace
+from unittest import mock
+
+import paho.mqtt.client as mqtt
+import pytest
+from pfal_controller.config import MQTTConfig
+from pfal_controller.mqtt_client import MQTTClient, decode_binary_payload
+
+SIMULATOR_PATH = os.path.join(os.path.dirname(__file__), '..', 'examples', 'esp32_sensor_simulator.py')
+
+# A fixture to load the example simulator, whose encoder produces the sensor frames
+@pytest.fixture(scope='module')
+def simulator():
+    """Returns the examples/esp32_sensor_simulator.py module."""
+    spec = importlib.util.spec_from_file_location('esp32_sensor_simulator', SIMULATOR_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# A fixture to create an MQTT client whose paho client is a MagicMock
+@pytest.fixture
+def client():
+    """Returns an MQTTClient with the default topics and a mocked paho client."""
+    client = MQTTClient(MQTTConfig(
+        broker='localhost',
+        port=1883,
+        username=None,
+        password=None,
+        client_id='test_client',
+        topic_ph='pfal/sensors/ph',
+        topic_ec='pfal/sensors/ec',
+        topic_temp='pfal/sensors/temperature',
+        topic_bme280='pfal/sensors/bme280',
+        topic_ph_pump='pfal/actuators/ph_pump',
+        topic_nutrient_pump='pfal/actuators/nutrient_pump',
+        topic_main_pump='pfal/actuators/main_pump',
+        topic_lights='pfal/actuators/lights',
+        topic_fans='pfal/actuators/fans',
+    ))
+    client.client = mock.MagicMock()
+    client.client.publish.return_value.rc = 0
+    return client
+
+def message(topic, payload, retain=False):
+    """Build a stand-in for a received paho MQTTMessage."""
+    return SimpleNamespace(topic=topic, payload=payload, retain=retain)
+
+# --- Actuator State Tests ---
+
+def test_retained_actuator_state_ignores_live_echoes(client):
+    """
+    GIVEN fans ON retained on the broker and delivered on subscribe
+    WHEN a stale live OFF echo arrives on the fans topic
+    THEN the retained ON should still be reported as the broker state.
+    """
+    # Arrange
+    client._on_message(client.client, None, message('pfal/actuators/fans', b'{"command":"ON"}', retain=True))
+
+    # Act
+    client._on_message(client.client, None, message('pfal/actuators/fans', b'{"command":"OFF"}'))
+
+    # Assert
+    assert client.get_retained_command('fans') == 'ON'
+    assert client.get_retained_command('lights') is None
+
+def test_publish_command_sends_command_matching_retained_state(client):
+    """
+    GIVEN lights ON retained on the broker
+    WHEN the lights ON command is published
+    THEN it should still be sent, since de-duplication is left to the controller.
+    """
+    # Arrange
+    client._on_message(client.client, None, message('pfal/actuators/lights', b'{"command":"ON"}', retain=True))
+
+    # Act
+    client.publish_command('lights', 'ON')
+
+    # Assert
+    client.client.publish.assert_called_once_with('pfal/actuators/lights', b'{"command":"ON"}',
+                                                  qos=0, retain=True)
+
+@pytest.mark.parametrize("actuator, expected", [
+    ('lights', False),   # QoS 0: dropped by paho
+    ('ph_pump', True),   # QoS 1: queued until reconnect
+])
+def test_publish_while_disconnected_reports_whether_the_command_is_kept(client, actuator, expected):
+    """
+    GIVEN a client whose broker connection is down
+    WHEN a command is published
+    THEN only a QoS 1 command, which paho queues, should count as published.
+    """
+    # Arrange
+    client.client.publish.return_value.rc = mqtt.MQTT_ERR_NO_CONN
+
+    # Act
+    published = client.publish_command(actuator, 'ON')
+
+    # Assert
+    assert published is expected
+
+def test_connect_runs_connect_callbacks(client):
+    """
+    GIVEN a registered connect callback
+    WHEN the broker accepts the connection
+    THEN the callback should be run once.
+    """
+    # Arrange
+    callback = mock.MagicMock()
+    client.register_connect_callback(callback)
+
+    # Act
+    client._on_connect(client.client, None, None, 0, None)
+
+    # Assert
+    callback.assert_called_once_with()
+
+def test_actuator_state_is_complete_after_the_sensor_suback(client):
+    """
+    GIVEN a client that has just connected and subscribed
+    WHEN the actuator topics' SUBACK arrives, and then the sensor topics' SUBACK
+    THEN the retained actuator state should only be complete after the second.
+    """
+    # Arrange
+    client.client.subscribe.side_effect = [(0, 1), (0, 2)]
+    client._on_connect(client.client, None, None, 0, None)
+
+    # Act
+    client._on_subscribe(client.client, None, 1, [0] * 5, None)
+    complete_after_actuators = client.wait_for_actuator_state(0)
+    client._on_subscribe(client.client, None, 2, [0] * 4, None)
+    complete_after_sensors = client.wait_for_actuator_state(0)
+
+    # Assert
+    first_topics = [topic for topic, _ in client.client.subscribe.call_args_list[0].args[0]]
+    assert first_topics == list(client._actuator_topics.values())
+    assert complete_after_actuators is False
+    assert complete_after_sensors is True
+
+def test_reconnect_forgets_retained_state_until_redelivered(client):
+    """
+    GIVEN fans ON retained on the broker
+    WHEN the client reconnects
+    THEN the state should be unknown until the broker delivers it again.
+    """
+    # Arrange
+    client._on_message(client.client, None, message('pfal/actuators/fans', b'{"command":"ON"}', retain=True))
+
+    # Act
+    client._on_connect(client.client, None, None, 0, None)
+
+    # Assert
+    assert client.get_retained_command('fans') is None
+    assert client.wait_for_actuator_state(0) is False
+
+# --- Binary Payload Tests ---
+
+@pytest.mark.parametrize("value", [6.25, -5.5, 0.0, 327.67])
+def test_binary_value_frame_round_trips_simulator_encoding(simulator, value):
+    """
+    GIVEN a single-value reading encoded by the simulator as a binary frame
+    WHEN the frame is decoded
+    THEN the value and node sensor_id should be recovered.
+    """
+    # Arrange
+    payload = simulator.PayloadEncoder(node_index=7, wire_format='binary').encode_value(value)
+
+    # Act
+    data = decode_binary_payload(payload)
+
+    # Assert
+    assert data == {'value': value, 'sensor_id': 'esp32_7'}
+
+def test_binary_bme280_frame_round_trips_simulator_encoding(simulator):
+    """
+    GIVEN a BME280 reading encoded by the simulator as a binary frame
+    WHEN the frame is decoded as a BME280 frame
+    THEN temperature, humidity, pressure and sensor_id should be recovered.
+    """
+    # Arrange
+    payload = simulator.PayloadEncoder(node_index=2, wire_format='binary').encode_bme280(24.51, 61.2, 1013.3)
+
+    # Act
+    data = decode_binary_payload(payload, bme280=True)
+
+    # Assert
+    assert data == {'temperature': 24.51, 'humidity': 61.2, 'pressure': 1013.3, 'sensor_id': 'esp32_2'}
+
+@pytest.mark.parametrize("payload, bme280", [
+    (b'\x71\x02', False),              # Short value frame
+    (b'\x71\x02\x01\x00', False),      # Trailing byte
+    (b'\x71\x02\x01', True),          # Value frame on the BME280 topic
+])
+def test_binary_frame_of_wrong_length_is_rejected(payload, bme280):
+    """
+    GIVEN a payload that is not exactly one frame long
+    WHEN it is decoded
+    THEN a ValueError should be raised.
+    """
+    # Act / Assert
+    with pytest.raises(ValueError):
+        decode_binary_payload(payload, bme280=bme280)
+
+def test_malformed_binary_frame_is_not_dispatched(client):
+    """
+    GIVEN a client using the binary wire format
+    WHEN a truncated frame arrives on a sensor topic
+    THEN it should be dropped instead of queued for the sensor callbacks.
+    """
+    # Arrange
+    client.config.wire_format = 'binary'
+
+    # Act
+    client._on_message(client.client, None, message('pfal/sensors/ph', b'\x71'))
+
+    # Assert
+    assert len(client._rx_queue) == 0
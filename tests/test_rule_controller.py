@@ -1,3 +1,5 @@
+import dataclasses
+
 import pytest
 from pfal_controller.rule_controller import RuleBasedController
 from pfal_controller.config import ControlConfig
@@ -40,9 +42,9 @@ def test_ph_too_low_triggers_pump(default_config):
 
     # Assert
     assert command is not None
-    assert command['action'] == 'ph_pump'
-    assert command['command'] == 'ON'
-    assert command['duration_ms'] == default_config.ph_pump_duration_ms
+    assert command.action == 'ph_pump'
+    assert command.command == 'ON'
+    assert command.duration_ms == default_config.ph_pump_duration_ms
 
 def test_ph_in_range_does_nothing(default_config):
     """
@@ -66,43 +68,43 @@ def test_temperature_too_high_triggers_fans(default_config):
     """
     GIVEN a default configuration
     WHEN the temperature reading is above the maximum
-    THEN the temperature rule should return a command to turn on the fans.
+    THEN the fan rule should return a command to turn on the fans.
     """
     # Arrange
     controller = RuleBasedController(default_config)
     controller.update_sensor_reading('temperature', 29.5)
 
     # Act
-    command = controller.evaluate_temperature_control()
+    command = controller.evaluate_fan_control()
 
     # Assert
     assert command is not None
-    assert command['action'] == 'fans'
-    assert command['command'] == 'ON'
+    assert command.action == 'fans'
+    assert command.command == 'ON'
 
 def test_humidity_too_high_triggers_fans(default_config):
     """
     GIVEN a default configuration
     WHEN the humidity reading is above the maximum
-    THEN the humidity rule should return a command to turn on the fans.
+    THEN the fan rule should return a command to turn on the fans.
     """
     # Arrange
     controller = RuleBasedController(default_config)
     controller.update_sensor_reading('humidity', 75.0)
 
     # Act
-    command = controller.evaluate_humidity_control()
+    command = controller.evaluate_fan_control()
 
     # Assert
     assert command is not None
-    assert command['action'] == 'fans'
-    assert command['command'] == 'ON'
+    assert command.action == 'fans'
+    assert command.command == 'ON'
 
 def test_fan_off_command_when_both_temp_and_humidity_are_normal(default_config):
     """
     GIVEN a default configuration
     WHEN both temperature and humidity are within their normal ranges (including hysteresis)
-    THEN both rules should independently suggest turning the fans OFF.
+    THEN the fan rule should return a command to turn the fans OFF.
     """
     # Arrange
     controller = RuleBasedController(default_config)
@@ -110,23 +112,18 @@ def test_fan_off_command_when_both_temp_and_humidity_are_normal(default_config):
     controller.update_sensor_reading('humidity', 64.0)  # Below humidity_max - 5.0
 
     # Act
-    temp_command = controller.evaluate_temperature_control()
-    humidity_command = controller.evaluate_humidity_control()
+    command = controller.evaluate_fan_control()
 
     # Assert
-    assert temp_command is not None
-    assert temp_command['action'] == 'fans'
-    assert temp_command['command'] == 'OFF'
-
-    assert humidity_command is not None
-    assert humidity_command['action'] == 'fans'
-    assert humidity_command['command'] == 'OFF'
+    assert command is not None
+    assert command.action == 'fans'
+    assert command.command == 'OFF'
 
 def test_fan_off_command_is_suppressed_if_temp_ok_but_humidity_high(default_config):
     """
     GIVEN a default configuration
     WHEN temperature returns to normal but humidity is still high
-    THEN the temperature rule should NOT return a command to turn fans OFF.
+    THEN the fan rule should keep the fans ON instead of turning them OFF.
     """
     # Arrange
     controller = RuleBasedController(default_config)
@@ -134,19 +131,17 @@ def test_fan_off_command_is_suppressed_if_temp_ok_but_humidity_high(default_conf
     controller.update_sensor_reading('humidity', 75.0)  # Humidity is HIGH
 
     # Act
-    temp_command = controller.evaluate_temperature_control() # This rule should now be suppressed
-    humidity_command = controller.evaluate_humidity_control() # This rule should request ON
+    command = controller.evaluate_fan_control()
 
     # Assert
-    assert temp_command is None # The temp rule should not try to turn the fan off
-    assert humidity_command is not None
-    assert humidity_command['command'] == 'ON'
+    assert command is not None
+    assert command.command == 'ON' # The normal temperature should not turn the fan off
 
 def test_fan_off_command_is_suppressed_if_humidity_ok_but_temp_high(default_config):
     """
     GIVEN a default configuration
     WHEN humidity returns to normal but temperature is still high
-    THEN the humidity rule should NOT return a command to turn fans OFF.
+    THEN the fan rule should keep the fans ON instead of turning them OFF.
     """
     # Arrange
     controller = RuleBasedController(default_config)
@@ -154,13 +149,28 @@ def test_fan_off_command_is_suppressed_if_humidity_ok_but_temp_high(default_conf
     controller.update_sensor_reading('humidity', 64.0)  # Humidity is OK
 
     # Act
-    temp_command = controller.evaluate_temperature_control() # This rule should request ON
-    humidity_command = controller.evaluate_humidity_control() # This rule should now be suppressed
+    command = controller.evaluate_fan_control()
 
     # Assert
-    assert temp_command is not None
-    assert temp_command['command'] == 'ON'
-    assert humidity_command is None # The humidity rule should not try to turn the fan off
+    assert command is not None
+    assert command.command == 'ON' # The normal humidity should not turn the fan off
+
+def test_fan_off_command_is_withheld_at_the_humidity_limit(default_config):
+    """
+    GIVEN a default configuration
+    WHEN temperature is back in range and humidity sits exactly at its maximum
+    THEN the fan rule should return no command.
+    """
+    # Arrange
+    controller = RuleBasedController(default_config)
+    controller.update_sensor_reading('temperature', 25.0) # Temp is OK
+    controller.update_sensor_reading('humidity', 70.0)  # Not above the maximum, not in range either
+
+    # Act
+    command = controller.evaluate_fan_control()
+
+    # Assert
+    assert command is None
 
 # --- Existing Lighting Test (Still Valid) ---
 
@@ -195,4 +205,194 @@ def test_lighting_schedule(default_config, hour, expected_command, monkeypatch):
     command = controller.evaluate_lighting_schedule()
 
     # Assert
-    assert command['command'] == expected_command
\ No newline at end of file
+    assert command.command == expected_command
+
+def test_lighting_schedule_only_reports_state_changes(default_config, monkeypatch):
+    """
+    GIVEN a lighting schedule that has already switched the lights ON
+    WHEN it is evaluated again within the schedule, and then after it
+    THEN it should return nothing until the lights need to turn OFF.
+    """
+    # Arrange
+    class MockDateTime:
+        hour = 12
+        def now(self):
+            return self
+
+    mock_datetime = MockDateTime()
+    monkeypatch.setattr('pfal_controller.rule_controller.datetime', mock_datetime)
+    controller = RuleBasedController(default_config)
+    first_command = controller.evaluate_lighting_schedule()
+
+    # Act
+    mock_datetime.hour = 13
+    repeated_command = controller.evaluate_lighting_schedule()
+    mock_datetime.hour = 22
+    off_command = controller.evaluate_lighting_schedule()
+
+    # Assert
+    assert first_command.command == 'ON'
+    assert repeated_command is None
+    assert off_command.command == 'OFF'
+
+# --- Per-Signal Evaluation Tests ---
+
+def test_evaluate_for_only_runs_rules_fed_by_the_signal(default_config):
+    """
+    GIVEN pH and temperature readings that both require action
+    WHEN rules are evaluated for the temperature signal only
+    THEN only the fan command should be returned.
+    """
+    # Arrange
+    controller = RuleBasedController(default_config)
+    controller.update_sensor_reading('ph', 5.6)
+    controller.update_sensor_reading('temperature', 29.5)
+
+    # Act
+    commands = controller.evaluate_for('temperature')
+
+    # Assert
+    assert [command.action for command in commands] == ['fans']
+
+def test_evaluate_for_humidity_runs_fan_rule(default_config):
+    """
+    GIVEN normal temperature and humidity readings
+    WHEN rules are evaluated for the humidity signal
+    THEN the fan rule should run and return a single fan OFF command.
+    """
+    # Arrange
+    controller = RuleBasedController(default_config)
+    controller.update_sensor_reading('temperature', 25.0)
+    controller.update_sensor_reading('humidity', 64.0)
+
+    # Act
+    commands = controller.evaluate_for('humidity')
+
+    # Assert
+    assert len(commands) == 1
+    assert commands[0].action == 'fans'
+    assert commands[0].command == 'OFF'
+
+def test_evaluate_for_multiple_signals_matches_rule_order(default_config):
+    """
+    GIVEN pH and EC readings that both require dosing
+    WHEN rules are evaluated for both signals
+    THEN the commands should be returned in the same order as evaluate_all_rules.
+    """
+    # Arrange
+    controller = RuleBasedController(default_config)
+    controller.update_sensor_reading('ph', 5.6)
+    controller.update_sensor_reading('ec', 1.0)
+
+    # Act
+    commands = controller.evaluate_for('ec', 'ph')
+
+    # Assert
+    assert [command.action for command in commands] == ['ph_pump', 'nutrient_pump']
+
+def test_invalidate_thresholds_applies_mutated_config(default_config):
+    """
+    GIVEN a controller whose config target is changed after construction
+    WHEN the thresholds are invalidated
+    THEN the rules should evaluate against the new target.
+    """
+    # Arrange
+    controller = RuleBasedController(default_config)
+    controller.update_sensor_reading('ph', 6.1)
+    default_config.ph_target = 6.8
+
+    # Act
+    stale_command = controller.evaluate_ph_control()
+    controller.invalidate_thresholds()
+    command = controller.evaluate_ph_control()
+
+    # Assert
+    assert stale_command is None
+    assert command is not None
+    assert command.action == 'ph_pump'
+
+def test_update_config_rebuilds_rules_and_command_templates(default_config):
+    """
+    GIVEN a controller dosing for a low pH reading
+    WHEN a config with new pH, temperature, dose and lighting values is applied
+    THEN the rules, the dose command and the lighting commands should use the new values.
+    """
+    # Arrange
+    controller = RuleBasedController(default_config)
+    controller.update_sensor_reading('ph', 6.1)
+    controller.update_sensor_reading('temperature', 29.0)
+    new_config = dataclasses.replace(default_config, ph_target=6.8, ph_pump_duration_ms=2500,
+                                     temp_max=30.0, lights_on_hour=8)
+
+    # Act
+    old_commands = controller.evaluate_for('ph', 'temperature')
+    controller.update_config(new_config)
+    new_commands = controller.evaluate_for('ph', 'temperature')
+
+    # Assert
+    assert [command[:3] for command in old_commands] == [('fans', 'ON', None)]
+    assert [command[:3] for command in new_commands] == [('ph_pump', 'ON', 2500)]
+    assert str(controller._lights_commands[True].reason) == 'Within lighting schedule (8:00-22:00)'
+
+def test_update_sensor_reading_coalesces_small_changes(default_config):
+    """
+    GIVEN a stored pH reading
+    WHEN a reading within the pH epsilon arrives, followed by a larger change
+    THEN only the larger change should replace the stored reading.
+    """
+    # Arrange
+    controller = RuleBasedController(default_config)
+    controller.update_sensor_reading('ph', 6.00)
+
+    # Act
+    small_change_kept = controller.update_sensor_reading('ph', 6.01)
+    value_after_small_change = controller.last_sensor_readings['ph'][0]
+    large_change_kept = controller.update_sensor_reading('ph', 6.10)
+
+    # Assert
+    assert small_change_kept is False
+    assert value_after_small_change == 6.00
+    assert large_change_kept is True
+    assert controller.last_sensor_readings['ph'][0] == 6.10
+
+def test_evaluate_all_rules_repeats_dose_until_reading_changes(default_config):
+    """
+    GIVEN a low pH reading that has already been evaluated
+    WHEN all rules are evaluated again, and then after pH returns to range
+    THEN the repeated evaluation should dose again and the changed reading
+    should no longer produce a pump command.
+    """
+    # Arrange
+    controller = RuleBasedController(default_config)
+    controller.update_sensor_reading('ph', 5.6)
+    first_commands = controller.evaluate_all_rules()
+
+    # Act
+    repeated_commands = controller.evaluate_all_rules()
+    controller.update_sensor_reading('ph', 6.0)
+    changed_commands = controller.evaluate_all_rules()
+
+    # Assert
+    assert [command.action for command in first_commands] == ['ph_pump', 'lights']
+    assert [command.action for command in repeated_commands] == ['ph_pump']
+    assert repeated_commands[0].duration_ms == default_config.ph_pump_duration_ms
+    assert changed_commands == []
+
+def test_evaluate_all_rules_merges_fan_requests(default_config):
+    """
+    GIVEN high temperature and normal humidity
+    WHEN all rules are evaluated
+    THEN a single fan ON command should be returned.
+    """
+    # Arrange
+    controller = RuleBasedController(default_config)
+    controller.update_sensor_reading('temperature', 30.0)
+    controller.update_sensor_reading('humidity', 60.0)
+
+    # Act
+    commands = controller.evaluate_all_rules()
+
+    # Assert
+    fan_commands = [command for command in commands if command.action == 'fans']
+    assert len(fan_commands) == 1
+    assert fan_commands[0].command == 'ON'